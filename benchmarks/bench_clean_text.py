@@ -0,0 +1,136 @@
+# benchmarks/bench_clean_text.py
+"""
+Microbenchmark for message text sanitization.
+
+Compares the previous multi-pass clean_text (four re.sub passes plus a
+separate IP pass, run once per output format) with the single-scan
+sanitizer in SlackExporter, on a synthetic corpus of Slack messages.
+
+Usage:
+    python benchmarks/bench_clean_text.py [--messages N] [--repeat R]
+
+"""
+import argparse, os, random, re, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import slack_channel_export_tool as tool
+
+
+# === PREVIOUS IMPLEMENTATION (for comparison) ===
+def legacy_is_private_or_special_ip(ip: str) -> bool:
+    try:
+        parts = [int(p) for p in ip.split('.')]
+        if len(parts) != 4:
+            return False
+        if parts[0] == 10:
+            return True
+        if parts[0] == 172 and 16 <= parts[1] <= 31:
+            return True
+        if parts[0] == 192 and parts[1] == 168:
+            return True
+        if parts[0] == 127:
+            return True
+        if parts[0] == 169 and parts[1] == 254:
+            return True
+        if ip == "0.0.0.0":
+            return True
+        public_dns = [
+            "8.8.8.8", "8.8.4.4",
+            "1.1.1.1", "1.0.0.1",
+            "9.9.9.9",
+            "208.67.222.222", "208.67.220.220"
+        ]
+        if ip in public_dns:
+            return True
+        return False
+    except (ValueError, IndexError):
+        return False
+
+
+def legacy_clean_text(text: str, format_type: str, anon_id, anonymize_ips: bool) -> str:
+    if format_type == "markdown":
+        text = re.sub(r"<@(U[0-9A-Z]+)>", lambda m: f"**@{anon_id(m.group(1))}**", text)
+    else:
+        text = re.sub(r"<@(U[0-9A-Z]+)>", lambda m: f"[@{anon_id(m.group(1))}]", text)
+    text = re.sub(r":(\w+):", r"\1", text)
+    text = re.sub(r"<(http[^>|]+)(\|[^>]+)?>", r"\1", text)
+    text = re.sub(r"<#[^>]+>", "[channel]", text)
+    if not anonymize_ips:
+        return text.strip()
+    ip_pattern = r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b'
+    text = re.sub(ip_pattern, lambda m: m.group(0) if legacy_is_private_or_special_ip(m.group(0)) else "[IP-REDACTED]", text)
+    return text.strip()
+
+
+# === CORPUS ===
+WORDS = ("deploy", "the", "build", "is", "green", "again", "please", "review", "ticket", "rollback",
+         "staging", "looks", "fine", "on", "my", "side", "can", "someone", "check", "logs")
+
+def make_corpus(count: int, seed: int = 7) -> list:
+    """Messages mixing plain prose with mentions, emoji, links, channel refs and IPs."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(8, 40))]
+        if rng.random() < 0.4:
+            parts.insert(rng.randrange(len(parts)), f"<@U{rng.randint(1, 200):06d}>")
+        if rng.random() < 0.3:
+            parts.append(rng.choice((":tada:", ":white_check_mark:", ":eyes:")))
+        if rng.random() < 0.2:
+            parts.append(f"<https://example.com/build/{i}|build {i}>")
+        if rng.random() < 0.1:
+            parts.insert(0, "<#C0123456|ops>")
+        if rng.random() < 0.1:
+            parts.append(rng.choice(("203.0.113.45", "10.8.0.2", "8.8.8.8", "198.51.100.7:443")))
+        parts.append(f"(#{i})")  # Keeps every text unique so caching only helps text/markdown sharing
+        corpus.append(" ".join(parts))
+    return corpus
+
+
+def bench(label: str, corpus: list, clean, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        clean(corpus)
+        best = min(best, time.perf_counter() - start)
+    rate = len(corpus) / best
+    print(f"   {label:<34} {rate:>12,.0f} messages/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    
+    corpus = make_corpus(args.messages)
+    settings = tool.ExportSettings()
+    exporter = tool.SlackExporter("xoxp-benchmark", tempfile.mkdtemp(prefix="bench-clean-text-"), settings=settings)
+    
+    def before(texts):
+        for text in texts:
+            legacy_clean_text(text, "text", exporter.anon_id, settings.anonymize_ips)
+            legacy_clean_text(text, "markdown", exporter.anon_id, settings.anonymize_ips)
+    
+    def after(texts):
+        exporter.clean_cached.cache_clear()
+        for text in texts:
+            exporter.clean_text(text, "text")
+            exporter.clean_text(text, "markdown")
+    
+    for anonymize_ips in (False, True):
+        settings.anonymize_ips = anonymize_ips
+        exporter.clean_cached.cache_clear()
+        for text in corpus:
+            for fmt in ("text", "markdown"):
+                assert exporter.clean_text(text, fmt) == legacy_clean_text(text, fmt, exporter.anon_id, anonymize_ips), text
+        print(f"\n🧪 {len(corpus):,} messages, text + markdown each, anonymize_ips={anonymize_ips}")
+        old = bench("before (multi-pass)", corpus, before, args.repeat)
+        new = bench("after (single scan, shared cache)", corpus, after, args.repeat)
+        print(f"   speedup: {new / old:.1f}x")
+    exporter.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+# benchmarks/bench_export.py
+"""
+Offline throughput benchmark for the exporter.
+
+Runs SlackExporter against a synthetic workspace: a fake WebClient serving
+N channels of M messages (with threads and attachments) and a local HTTP
+server for the attachment downloads, optionally answering every Kth API
+call with a ratelimited error and a Retry-After header. No Slack token or
+network access is needed.
+
+Each scenario runs in its own process so peak RSS is measured cleanly:
+    fetch_messages   history + thread replies, nothing written
+    export_channel   the full per-channel export (downloads included)
+    clean_text       text/markdown sanitizing of every message
+    download_file    attachment downloads, one after another
+    output_formats   smoke check of zstd and Parquet/Arrow outputs, read back
+                     after writing (skipped without zstandard and pyarrow)
+
+Usage:
+    python benchmarks/bench_export.py [--channels N] [--messages M]
+        [--thread-every T] [--replies R] [--file-every F] [--file-kb KB]
+        [--ratelimit-every K] [--retry-after S] [--scenario NAME ...]
+        [--rich] [--fields FIELD ...] [--compact-json] [--compression {none,gzip,zstd}]
+        [--real-rate-limits] [--json PATH]
+"""
+import argparse, contextlib, http.server, io, json, os, shutil, subprocess, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import slack_channel_export_tool as tool
+from slack_sdk.errors import SlackApiError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ("fetch_messages", "export_channel", "clean_text", "download_file", "output_formats")
+PAGE_OLDEST = 1700000000.0
+
+
+# === FAKE SLACK ===
+class FakeResponse(dict):
+    """Just enough of SlackResponse for the exporter: item access plus headers."""
+    def __init__(self, data: dict, headers: dict = None):
+        super().__init__(data)
+        self.headers = headers or {}
+
+
+class FakeSlack:
+    """Synthetic workspace, generated on the fly so it costs no memory up front."""
+    def __init__(self, args, file_base_url: str = ""):
+        self.args = args
+        self.file_base_url = file_base_url
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.ratelimited = 0
+        self.channels = [{"id": f"C{i:06d}", "name": f"bench-{i}", "is_private": False}
+                         for i in range(args.channels)]
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+            reject = self.args.ratelimit_every and self.calls % self.args.ratelimit_every == 0
+            if reject:
+                self.ratelimited += 1
+        if reject:
+            raise SlackApiError("ratelimited", FakeResponse(
+                {"ok": False, "error": "ratelimited"}, {"Retry-After": str(self.args.retry_after)}
+            ))
+
+    def ts(self, index: int) -> str:
+        # Newest first, one message a minute
+        return f"{PAGE_OLDEST + (self.args.messages - index) * 60:.6f}"
+
+    def message(self, channel_id: str, index: int) -> dict:
+        args = self.args
+        msg = {
+            "type": "message", "user": f"U{index % 97:05d}", "ts": self.ts(index),
+            "text": (f"build {index} is green <@U{(index + 1) % 97:05d}> :tada: see "
+                     f"<https://ci.example.com/{index}|logs> from 203.0.113.{index % 250}"),
+        }
+        if args.thread_every and index % args.thread_every == 0:
+            msg["reply_count"] = args.replies
+            msg["latest_reply"] = f"{float(msg['ts']) + args.replies:.6f}"
+        if args.rich:
+            # What real payloads carry besides the text: rich-text blocks, the author's profile, unfurls
+            msg["blocks"] = [{"type": "rich_text", "block_id": f"b{index}", "elements": [{
+                "type": "rich_text_section", "elements": [
+                    {"type": "text", "text": f"build {index} is green "},
+                    {"type": "user", "user_id": f"U{(index + 1) % 97:05d}"},
+                    {"type": "emoji", "name": "tada", "unicode": "1f389"},
+                    {"type": "link", "url": f"https://ci.example.com/{index}", "text": "logs"},
+                ]}]}]
+            msg["user_profile"] = {
+                "avatar_hash": f"g{index % 97:011x}", "image_72": f"https://avatars.example.com/{index % 97}_72.png",
+                "first_name": f"User{index % 97}", "real_name": f"User {index % 97}",
+                "display_name": f"user{index % 97}", "team": "T00000001", "name": f"user{index % 97}",
+                "is_restricted": False, "is_ultra_restricted": False,
+            }
+            msg["attachments"] = [{
+                "from_url": f"https://ci.example.com/{index}", "title": f"Build #{index}",
+                "title_link": f"https://ci.example.com/{index}", "service_name": "CI",
+                "text": "All 1,204 tests passed in 3m 12s", "fallback": f"CI: Build #{index}", "id": 1,
+            }]
+            msg["client_msg_id"] = f"{index:08x}-0000-4000-8000-{index:012x}"
+            msg["team"] = "T00000001"
+        if args.file_every and index % args.file_every == 0:
+            file_id = f"F{channel_id}{index}"
+            msg["files"] = [{
+                "id": file_id, "name": f"report-{index}.bin", "mimetype": "application/octet-stream",
+                "size": args.file_kb * 1024,
+                "url_private_download": f"{self.file_base_url}/{file_id}?size={args.file_kb * 1024}",
+            }]
+        return msg
+
+    def users_list(self, cursor=None, **kwargs):
+        self._call()
+        return FakeResponse({"members": [{"id": f"U{i:05d}", "name": f"user{i}"} for i in range(97)],
+                             "response_metadata": {"next_cursor": ""}})
+
+    def conversations_list(self, cursor=None, **kwargs):
+        self._call()
+        return FakeResponse({"channels": self.channels, "response_metadata": {"next_cursor": ""}})
+
+    def conversations_history(self, channel, cursor=None, limit=200, **kwargs):
+        self._call()
+        start = int(cursor or 0)
+        end = min(start + limit, self.args.messages)
+        more = end < self.args.messages
+        return FakeResponse({
+            "messages": [self.message(channel, i) for i in range(start, end)],
+            "has_more": more, "response_metadata": {"next_cursor": str(end) if more else ""},
+        })
+
+    def conversations_replies(self, channel, ts, cursor=None, limit=200, **kwargs):
+        self._call()
+        parent = {"type": "message", "user": "U00000", "ts": ts, "text": "parent"}
+        replies = [{"type": "message", "user": f"U{k % 97:05d}", "ts": f"{float(ts) + k + 1:.6f}",
+                    "thread_ts": ts, "text": f"reply {k} on <@U00001>"} for k in range(self.args.replies)]
+        return FakeResponse({"messages": [parent] + replies, "has_more": False,
+                             "response_metadata": {"next_cursor": ""}})
+
+    def files_info(self, file, **kwargs):
+        self._call()
+        size = self.args.file_kb * 1024
+        return FakeResponse({"file": {"id": file, "url_private_download": f"{self.file_base_url}/{file}?size={size}"}})
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like Slack's file servers
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        size = int(self.path.rsplit("size=", 1)[-1]) if "size=" in self.path else 1024
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = b"x" * 65536
+        while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+
+
+def start_file_server() -> tuple:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/files"
+
+
+# === SCENARIOS ===
+def peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def make_exporter(args, fake: FakeSlack, folder: str, download_files: bool):
+    settings = tool.ExportSettings()
+    settings.download_files = download_files
+    settings.enable_logging = False
+    settings.metrics_enabled = False
+    settings.message_fields = args.fields[0] if args.fields == ["full"] else args.fields
+    settings.compact_json = args.compact_json
+    settings.compression = args.compression
+    exporter = tool.SlackExporter("xoxp-benchmark", folder, settings=settings)
+    exporter.client = fake
+    return exporter
+
+
+def read_table(path: str):
+    if path.endswith(tool.ArrowWriter.suffix):
+        with tool.pyarrow.OSFile(path) as source:
+            return tool.pyarrow.ipc.open_file(source).read_all()
+    return tool.pyarrow.parquet.read_table(path)
+
+
+def check_output_formats(exporter, folder: str) -> tuple:
+    """Export every channel as zstd JSON/TXT and as Parquet and Arrow tables, then read them back.
+
+    Also appends to the zstd TXT (as incremental runs do) and renumbers the
+    tables' anon IDs (as --merge-shards does). Only the formats whose
+    packages are installed are checked, returns (messages written, formats checked).
+    """
+    variants = []
+    if tool.HAS_ZSTD:
+        variants.append(("zstd", None))
+    if tool.HAS_PYARROW:
+        variants += [("none", "parquet"), ("none", "arrow")]
+    messages = 0
+    exporter.load_users()
+    for compression, columnar in variants:
+        exporter.settings.compression = compression
+        exporter.settings.columnar = columnar
+        exporter.export_folder = os.path.join(folder, columnar or compression)
+        os.makedirs(exporter.export_folder)
+        for channel in exporter.get_channels():
+            _, count, json_name, txt_name, _ = exporter.export_channel(channel, None, "bench")
+            messages += count
+            for name in (json_name, txt_name):
+                path = os.path.join(exporter.export_folder, name)
+                assert tool.compression_of(path) == compression, name
+                with tool.open_output(path, "rt", compression) as f:
+                    data = json.load(f) if name == json_name else f.read()
+                assert (len(data) == count) if name == json_name else data, f"{name} doesn't read back"
+            if compression != "none":
+                path = os.path.join(exporter.export_folder, txt_name)
+                with tool.open_output(path, "at", compression) as f:
+                    f.write("appended\n")
+                with tool.open_output(path, "rt", compression) as f:
+                    assert f.read() == data + "appended\n", f"{txt_name} loses appended lines"
+            if columnar:
+                path = os.path.join(exporter.export_folder, json_name[:-len(".json")] + "." + columnar)
+                table = read_table(path)
+                top_level = sum(not is_reply for is_reply in table.column("is_reply").to_pylist())
+                assert top_level == count, f"{os.path.basename(path)} has {top_level} of {count} messages"
+                users = table.column("user").to_pylist()
+                renamed = path + ".renamed." + columnar
+                tool.rename_columnar(path, renamed, {users[0]: "anon99"})
+                expected = ["anon99" if user == users[0] else user for user in users]
+                assert read_table(renamed).column("user").to_pylist() == expected, f"{renamed} isn't renamed"
+    return messages, [columnar or compression for compression, columnar in variants]
+
+
+def run_scenario(name: str, args) -> dict:
+    """Run one scenario in this process, returns its measurements."""
+    if not args.real_rate_limits:
+        tool.RATE_LIMIT_TIERS.update({tier: 10 ** 9 for tier in tool.RATE_LIMIT_TIERS})
+    server, base_url = start_file_server()
+    fake = FakeSlack(args, base_url)
+    folder = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    exporter = make_exporter(args, fake, folder, download_files=name in ("export_channel", "download_file"))
+    messages = units = output_bytes = 0
+    formats = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if name == "fetch_messages":
+                for channel in fake.channels:
+                    messages += len(exporter.fetch_messages(channel["id"], None))
+                units = messages
+            elif name == "export_channel":
+                exporter.load_users()
+                for channel in exporter.get_channels():
+                    result = exporter.export_channel(channel, None, "bench")
+                    messages += result[1]
+                    output_bytes += os.path.getsize(os.path.join(folder, result[2]))
+                units = messages
+            elif name == "clean_text":
+                texts = [fake.message(fake.channels[0]["id"], i)["text"] for i in range(args.messages)]
+                start = time.perf_counter()
+                for channel in fake.channels:
+                    exporter.clean_cached.cache_clear()
+                    for text in texts:
+                        exporter.clean_text(text, "text")
+                        exporter.clean_text(text, "markdown")
+                units = messages = len(texts) * len(fake.channels)
+            elif name == "download_file":
+                if not tool.HAS_REQUESTS:
+                    return {"scenario": name, "skipped": "requests is not installed"}
+                files = [(channel, fake.message(channel["id"], i))
+                         for channel in fake.channels for i in range(args.messages)
+                         if args.file_every and i % args.file_every == 0]
+                start = time.perf_counter()
+                for channel, msg in files:
+                    if exporter.download_file(msg["files"][0], channel["name"], msg["ts"]):
+                        units += 1
+                messages = len(files)
+            elif name == "output_formats":
+                if not (tool.HAS_ZSTD or tool.HAS_PYARROW):
+                    return {"scenario": name, "skipped": "zstandard and pyarrow are not installed"}
+                units, formats = check_output_formats(exporter, folder)
+                messages = units
+        elapsed = time.perf_counter() - start
+    finally:
+        exporter.close()
+        server.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        "scenario": name,
+        "unit": "files" if name == "download_file" else "msgs",
+        "count": units,
+        "seconds": round(elapsed, 3),
+        "per_second": units / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "api_calls": fake.calls,
+        "api_calls_per_msg": fake.calls / messages if messages else 0.0,
+        "ratelimited": fake.ratelimited,
+        "mb_per_second": (exporter.metrics.download_bytes / 1024 / 1024 / elapsed) if elapsed else 0.0,
+        "json_output_mb": output_bytes / 1024 / 1024,
+        "formats": formats,
+    }
+
+
+def child_command(args, scenario: str) -> list:
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--scenario", scenario]
+    for key in ("channels", "messages", "thread_every", "replies", "file_every", "file_kb",
+                "ratelimit_every", "retry_after"):
+        command += ["--" + key.replace("_", "-"), str(getattr(args, key))]
+    command += ["--fields", *args.fields, "--compression", args.compression]
+    for flag in ("real_rate_limits", "rich", "compact_json"):
+        if getattr(args, flag):
+            command.append("--" + flag.replace("_", "-"))
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=5000, help="messages per channel")
+    parser.add_argument("--thread-every", type=int, default=5, help="every Nth message starts a thread (0: none)")
+    parser.add_argument("--replies", type=int, default=3, help="replies per thread")
+    parser.add_argument("--file-every", type=int, default=20, help="every Nth message has a file (0: none)")
+    parser.add_argument("--file-kb", type=int, default=64, help="attachment size in KB")
+    parser.add_argument("--ratelimit-every", type=int, default=0, help="reject every Kth API call (0: never)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on rejected calls")
+    parser.add_argument("--real-rate-limits", action="store_true",
+                        help="keep Slack's per-tier call budgets (very slow)")
+    parser.add_argument("--rich", action="store_true",
+                        help="give messages realistic blocks, user_profile and unfurl attachments")
+    parser.add_argument("--fields", nargs="+", default=["full"], metavar="FIELD",
+                        help="projection.fields to export with (default: full)")
+    parser.add_argument("--compact-json", action="store_true", help="write unindented JSON")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="none",
+                        help="compress the channel outputs")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.scenario[0], args)))
+        return
+
+    print(f"\n🧪 {args.channels} channels × {args.messages:,} messages, thread every {args.thread_every} "
+          f"({args.replies} replies), file every {args.file_every} ({args.file_kb} KB), "
+          f"ratelimit every {args.ratelimit_every or '-'} calls")
+    print(f"   {'scenario':<16} {'throughput':>16} {'peak RSS':>10} {'API calls/msg':>14} {'ratelimited':>12}")
+    results = []
+    for name in args.scenario:
+        proc = subprocess.run(child_command(args, name), capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"   {name:<16} failed:\n{proc.stderr}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        if result.get("skipped"):
+            print(f"   {name:<16} skipped ({result['skipped']})")
+            continue
+        rss = f"{result['peak_rss_mb']:.1f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        rate = f"{result['per_second']:,.0f} {result['unit']}/s"
+        print(f"   {name:<16} {rate:>16} {rss:>10} {result['api_calls_per_msg']:>14.3f} {result['ratelimited']:>12}")
+        if name == "download_file":
+            print(f"   {'':<16} {result['mb_per_second']:>13.1f} MB/s")
+        if name == "export_channel":
+            print(f"   {'':<16} {result['json_output_mb']:>13.1f} MB of JSON")
+        if name == "output_formats":
+            print(f"   {'':<16} read back: {', '.join(result['formats'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parameters": {k: v for k, v in vars(args).items() if k not in ("json", "child")},
+                       "results": results}, f, indent=2)
+        print(f"\n📄 Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,8 +30,13 @@ This tool is provided for legitimate backup, compliance, and archival purposes o
 """
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
-import json, re, os, time, sys, logging
-from datetime import datetime, timedelta
+import argparse, json, re, os, time, sys, logging, threading, shutil, hashlib, gzip, heapq, ipaddress, sqlite3, fnmatch, bisect, subprocess, hmac, secrets
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
 from pathlib import Path
 
@@ -42,8 +47,26 @@ try:
 except ImportError:
     HAS_REQUESTS = False
 
+# Optional: zstd-compressed outputs
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+# Optional: Parquet / Arrow IPC outputs
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
 # === CONFIGURATION LOADER ===
-def load_config():
+def load_config(config_path: Optional[str] = None):
     """Load configuration from config.json if it exists, otherwise use defaults."""
     default_config = {
         "slack_token": "xoxp-123456789...",
@@ -56,13 +79,15 @@ def load_config():
             "enable_logging": True
         },
         "performance": {
-            "max_retries": 3
+            "max_retries": 3,
+            "max_workers": 1,
+            "thread_workers": 4
         }
     }
     
-    # Look for config.json in the same directory as this script
+    # Look for config.json in the same directory as this script unless a path is given
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, "config.json")
+    config_path = config_path or os.path.join(script_dir, "config.json")
     
     if os.path.exists(config_path):
         try:
@@ -76,46 +101,159 @@ def load_config():
             return default_config
     else:
         print("ℹ️  No config.json found - using default settings")
-        print(f"   Looking in: {script_dir}")
+        print(f"   Looking in: {os.path.dirname(os.path.abspath(config_path))}")
         print("   To use config file: copy config.example.json to config.json and edit")
         return default_config
 
-# Load configuration
-config = load_config()
-
-# Extract settings from config
-SLACK_TOKEN = config.get("slack_token", "xoxp-123456789...")
-OUTPUT_DIR = config.get("output_dir", r"C:\SlackExports\Output")
-FETCH_THREADS = config.get("features", {}).get("fetch_threads", True)
-INCLUDE_REACTIONS = config.get("features", {}).get("include_reactions", True)
-DOWNLOAD_FILES = config.get("features", {}).get("download_files", False)
-CREATE_MARKDOWN = config.get("features", {}).get("create_markdown", False)
-ENABLE_LOGGING = config.get("features", {}).get("enable_logging", True)
-ANONYMIZE_IPS = config.get("features", {}).get("anonymize_ips", False)
-MAX_RETRIES = config.get("performance", {}).get("max_retries", 3)
-
-# Create timestamped export folder
-EXPORT_TIMESTAMP = datetime.now().strftime("%Y-%m-%d-%H%M")
-EXPORT_FOLDER = os.path.join(OUTPUT_DIR, EXPORT_TIMESTAMP)
-os.makedirs(EXPORT_FOLDER, exist_ok=True)
-
-# Validate token
-if SLACK_TOKEN == "xoxp-123456789..." or not SLACK_TOKEN.startswith("xoxp-"):
-    print("\n" + "="*60)
-    print("❌ ERROR: Invalid or missing Slack token!")
-    print("="*60)
-    print("\nPlease set up your configuration:")
-    print("1. Copy config.example.json to config.json")
-    print("2. Edit config.json and add your real token")
-    print("3. Get your token from: https://api.slack.com/apps")
-    print("\nOr edit the SLACK_TOKEN variable at the top of this script.")
-    print("="*60 + "\n")
-    input("Press Enter to exit...")
-    sys.exit(1)
+DEFAULT_TOKEN = "xoxp-123456789..."
+MAX_PENDING_PAGES = 8  # History pages held back while their thread replies are fetched
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+STALE_URL_STATUSES = (403, 404)  # Expired or revoked file URLs, worth one files.info refresh
+STATE_FILENAME = "export-state.json"
+ANON_KEY_FILENAME = "anonymization-key.json"  # The rolling archive's single key file
+CHECKPOINT_DIRNAME = ".checkpoint"
+METRICS_FILENAME = "metrics.json"
+SHARD_MANIFEST = "shard-manifest.json"
+SHARD_ARCHIVE_DB = "shard-archive.sqlite3"  # A shard's own archive database, imported by --merge-shards
+SHARD_SEARCH_INDEX = "shard-search-index.sqlite3"  # A shard's own search index, imported by --merge-shards
+SHARD_SUMMARY = "shards.json"
+ANON_ID_RE = re.compile(r"\banon\d{2,}\b")  # Sequential IDs only, keyed pseudonyms are "anon-<hex>"
+PSEUDONYM_HEX_DIGITS = 12
+# Message fields the exporter itself relies on, kept by every projection
+PROJECTION_REQUIRED_FIELDS = frozenset(("ts", "user", "text", "thread_ts", "reply_count", "latest_reply"))
+PROJECTION_FILE_FIELDS = frozenset(("id", "name", "title", "mimetype", "filetype", "size",
+                                    "url_private", "url_private_download", "permalink"))
+CHANNEL_ID_RE = re.compile(r"[CG][A-Z0-9]{2,}")
+USER_ID_RE = re.compile(r"[UW][A-Z0-9]{2,}")
+USERS_PAGE_SIZE = 200  # Members per users.list page
+
+
+class ExportSettings:
+    """Every tunable of an export, read from a config.json-style dict.
+    
+    Missing keys fall back to the defaults below, so library users can start
+    from ``ExportSettings()`` or ``ExportSettings(load_config(path))`` and
+    adjust attributes before creating a SlackExporter.
+    """
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        features = config.get("features", {})
+        performance = config.get("performance", {})
+        attachments = config.get("attachments", {})
+        incremental = config.get("incremental", {})
+        cache = config.get("cache", {})
+        filters = config.get("filters", {})
+        
+        self.slack_token = os.environ.get("SLACK_TOKEN") or config.get("slack_token", DEFAULT_TOKEN)
+        self.output_dir = config.get("output_dir", r"C:\SlackExports\Output")
+        self.fetch_threads = features.get("fetch_threads", True)
+        self.include_reactions = features.get("include_reactions", True)
+        self.download_files = features.get("download_files", False)
+        self.create_markdown = features.get("create_markdown", False)
+        self.enable_logging = features.get("enable_logging", True)
+        self.anonymize_ips = features.get("anonymize_ips", False)
+        self.streaming_output = features.get("streaming_output", False)
+        
+        self.max_retries = performance.get("max_retries", 3)
+        self.rate_limit_delay = float(performance.get("rate_limit_delay", 0))
+        self.max_workers = max(1, int(performance.get("max_workers", 1)))
+        self.thread_workers = max(1, int(performance.get("thread_workers", 4)))
+        self.download_pool_size = max(1, int(performance.get("download_pool_size", 10)))
+        self.download_workers = max(1, int(performance.get("download_workers", 4)))
+        self.download_per_host = max(1, int(performance.get("download_per_host", 4)))
+        self.user_resolution = performance.get("user_resolution", "auto")
+        self.user_preload_threshold = int(performance.get("user_preload_threshold", 1000))
+        
+        self.blob_store = attachments.get("blob_store", False)
+        self.blob_store_dir = attachments.get("blob_store_dir") or os.path.join(self.output_dir, ".blobstore")
+        self.link_mode = attachments.get("link_mode", "hardlink")
+        self.url_refresh = attachments.get("url_refresh", "lazy")
+        
+        self.incremental = incremental.get("enabled", False)
+        self.archive_dir = incremental.get("archive_dir") or os.path.join(self.output_dir, "archive")
+        self.thread_active_days = incremental.get("thread_active_days", 30)
+        
+        self.cache_enabled = cache.get("enabled", False)
+        self.cache_refresh = False
+        self.cache_path = cache.get("path") or os.path.join(self.output_dir, ".api-cache.sqlite3")
+        self.cache_max_bytes = int(cache.get("max_size_mb", 256) * 1024 * 1024)
+        self.cache_ttls = {
+            "users.list": 86400,
+            "users.info": 86400,
+            "conversations.list": 6 * 3600,
+            "conversations.replies": 30 * 86400,  # Also checked against the thread's latest_reply
+            **cache.get("ttl_seconds", {}),
+        }
+        self.archive_db = config.get("archive_db", {}).get("enabled", False)
+        self.archive_db_path = (config.get("archive_db", {}).get("path")
+                                or os.path.join(self.output_dir, "slack-archive.sqlite3"))
+        self.search_index = config.get("search_index", {}).get("enabled", False)
+        self.search_index_path = (config.get("search_index", {}).get("path")
+                                  or os.path.join(self.output_dir, "search-index.sqlite3"))
+        
+        self.include_channels = list(filters.get("include_only_channels") or [])
+        self.exclude_channels = list(filters.get("exclude_channels") or [])
+        self.exclude_users = set(filters.get("exclude_users") or [])
+        self.date_range_days = filters.get("date_range_days")
+        
+        output = config.get("output", {})
+        self.compression = output.get("compression", "none")
+        self.compression_level = output.get("compression_level")
+        self.columnar = output.get("columnar")
+        
+        projection = config.get("projection", {})
+        self.message_fields = projection.get("fields", "full")
+        self.compact_json = projection.get("compact_json", False)
+        
+        anonymization = config.get("anonymization", {})
+        self.pseudonyms = anonymization.get("pseudonyms", "sequential")
+        self.pseudonym_secret = (os.environ.get("SLACK_EXPORT_PSEUDONYM_SECRET")
+                                 or anonymization.get("pseudonym_secret"))
+        self.pseudonym_secret_file = (anonymization.get("pseudonym_secret_file")
+                                      or os.path.join(self.output_dir, ".pseudonym-secret"))
+        
+        metrics = config.get("metrics", {})
+        self.metrics_enabled = metrics.get("enabled", True)
+        self.prometheus_textfile = metrics.get("prometheus_textfile")
+        
+        self.shard_tokens = list(config.get("sharding", {}).get("tokens") or [])
+    
+    def token_is_valid(self) -> bool:
+        return self.slack_token != DEFAULT_TOKEN and self.slack_token.startswith("xoxp-")
+
+
+def load_pseudonym_key(settings: ExportSettings) -> bytes:
+    """The secret for keyed pseudonyms: from the config, else from (or newly written to) the secret file."""
+    if settings.pseudonym_secret:
+        return settings.pseudonym_secret.encode("utf-8")
+    path = settings.pseudonym_secret_file
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # Another process (e.g. a parallel shard) created it first
+        else:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(secrets.token_hex(32) + "\n")
+            print(f"🔑 Created pseudonym secret {path}")
+            print("    (Keep it to get the same anonymous IDs in later runs and on other hosts)")
+            logger.info(f"Created pseudonym secret {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip().encode("utf-8")
+
 
-# Configure logging if enabled
-if ENABLE_LOGGING:
-    log_filename = os.path.join(EXPORT_FOLDER, f"{EXPORT_TIMESTAMP}-export.log")
+def keyed_pseudonym(key: bytes, uid: str) -> str:
+    """Anonymous ID derived from the user ID alone, so every run and worker agrees on it."""
+    return "anon-" + hmac.new(key, uid.encode("utf-8"), hashlib.sha256).hexdigest()[:PSEUDONYM_HEX_DIGITS]
+
+
+def setup_logging(settings: ExportSettings, export_folder: str, timestamp_str: str) -> Optional[str]:
+    """Log to a file in the export folder (and the console) if enabled, returns the log path."""
+    if not settings.enable_logging:
+        logging.basicConfig(level=logging.WARNING)
+        return None
+    log_filename = os.path.join(export_folder, f"{timestamp_str}-export.log")
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s',
@@ -124,45 +262,1710 @@ if ENABLE_LOGGING:
             logging.StreamHandler(sys.stdout)
         ]
     )
-    logger = logging.getLogger(__name__)
-else:
-    logging.basicConfig(level=logging.WARNING)
-    logger = logging.getLogger(__name__)
+    return log_filename
+
+
+# === TEXT SANITIZATION ===
+IPV4_PATTERN = r"\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b"
+IPV4_RE = re.compile(IPV4_PATTERN)
+
+# Every token clean_text rewrites, as one alternation so a message is scanned once.
+# Links are matched whole, so colons inside URLs are no longer mistaken for emoji.
+SANITIZE_PATTERN = (
+    r"<(?:@(?P<user>U[0-9A-Z]+)>"
+    r"|(?P<url>http[^>|]+)(?:\|[^>]+)?>"
+    r"|(?P<channel>#[^>]+>))"
+    r"|:(?P<emoji>\w+):"
+)
+SANITIZE_RE = re.compile(SANITIZE_PATTERN)
+SANITIZE_IP_RE = re.compile(SANITIZE_PATTERN + r"|(?=\d)(?P<ip>" + IPV4_PATTERN + r")")
+CLEAN_CACHE_SIZE = 16384  # Raw texts whose cleaned text/markdown are kept for reuse
+
+# IPs that are kept when anonymizing: internal ranges and well-known public DNS servers
+IP_ALLOWLIST_NETWORKS = tuple(ipaddress.ip_network(net) for net in (
+    "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16",  # Private ranges (RFC 1918)
+    "127.0.0.0/8",                                    # Localhost
+    "169.254.0.0/16",                                 # Link-local
+    "0.0.0.0/32",                                     # Unspecified
+))
+PUBLIC_DNS_IPS = frozenset({
+    "8.8.8.8", "8.8.4.4",               # Google
+    "1.1.1.1", "1.0.0.1",               # Cloudflare
+    "9.9.9.9",                          # Quad9
+    "208.67.222.222", "208.67.220.220"  # OpenDNS
+})
+
+
+@lru_cache(maxsize=4096)
+def is_allowlisted_ip(ip: str) -> bool:
+    """Check if IP is private/internal or special use (should NOT be anonymized)."""
+    if ip in PUBLIC_DNS_IPS:
+        return True
+    try:
+        # Parsed by octet so zero-padded forms like 010.0.0.1 are still recognised
+        addr = ipaddress.IPv4Address(bytes(int(p) for p in ip.split(".")))
+    except ValueError:
+        return False
+    return any(addr in net for net in IP_ALLOWLIST_NETWORKS)
+
+
+def redact_ip(match) -> str:
+    ip = match.group(0)
+    return ip if is_allowlisted_ip(ip) else "[IP-REDACTED]"
+
+
+# === RATE LIMIT SCHEDULING ===
+# Slack Web API rate-limit tiers, in requests per minute per method
+RATE_LIMIT_TIERS = {1: 1, 2: 20, 3: 50, 4: 100}
+MAX_RATELIMIT_WAITS = 20  # Consecutive ratelimited responses before a call gives up
+METHOD_TIERS = {
+    "users.list": 2,
+    "users.info": 4,
+    "conversations.list": 2,
+    "conversations.info": 3,
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "files.info": 4,
+}
+DEFAULT_TIER = 3
+
+
+def channel_matches(channel: Dict, patterns: List[str]) -> bool:
+    """Whether a channel's ID or name matches any of the patterns (globs like ``team-*`` allowed)."""
+    name = channel.get("name") or ""
+    return any(p == channel.get("id") or fnmatch.fnmatchcase(name, p.lstrip("#")) for p in patterns)
+
+
+def shard_of(channel_id: str, shards: int) -> int:
+    """Shard number (1..shards) of a channel, the same on every host and run."""
+    digest = hashlib.sha1(channel_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards + 1
+
+
+def api_method_name(func) -> str:
+    """Map a WebClient method (e.g. conversations_history) to its API name."""
+    return getattr(func, "__name__", "unknown").replace("_", ".", 1)
+
+
+class RateLimitScheduler:
+    """Shared call budget for all workers, one adaptive token bucket per API method.
+    
+    Each bucket refills at its Slack tier's calls per minute (never faster
+    than one call per ``min_interval`` seconds) and holds a few seconds of
+    burst, so calls are paced before Slack has to reject them. A ratelimited
+    response pauses that method for Retry-After and lowers its rate; after
+    a minute's worth of calls without another rejection the rate creeps back
+    up towards the tier limit.
+    """
+    BURST_SECONDS = 3.0
+    DECREASE = 0.8  # Rate multiplier after a ratelimited response
+    INCREASE = 1.05  # Rate multiplier after a clean minute of calls
+    MIN_RATE = 1 / 60.0  # Calls per second, never paced slower than one a minute
+    
+    def __init__(self, min_interval: float = 0.0):
+        self.lock = threading.Lock()
+        self.min_interval = min_interval
+        self.buckets = {}
+        self.calls = {}
+        self.started = time.monotonic()
+    
+    def _bucket(self, method: str) -> Dict:
+        bucket = self.buckets.get(method)
+        if bucket is None:
+            ceiling = RATE_LIMIT_TIERS[METHOD_TIERS.get(method, DEFAULT_TIER)] / 60.0
+            if self.min_interval > 0:
+                ceiling = min(ceiling, 1.0 / self.min_interval)
+            capacity = max(1.0, ceiling * self.BURST_SECONDS)
+            bucket = self.buckets[method] = {
+                "rate": ceiling, "ceiling": ceiling, "capacity": capacity, "tokens": capacity,
+                "updated": time.monotonic(), "blocked_until": 0.0, "clean_calls": 0,
+            }
+        return bucket
+    
+    def acquire(self, method: str):
+        """Block until a call to `method` fits in its bucket."""
+        while True:
+            with self.lock:
+                bucket = self._bucket(method)
+                now = time.monotonic()
+                wait = bucket["blocked_until"] - now
+                if wait <= 0:
+                    refill = max(0.0, now - bucket["updated"]) * bucket["rate"]
+                    bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + refill)
+                    bucket["updated"] = now
+                    if bucket["tokens"] < 1:
+                        wait = (1 - bucket["tokens"]) / bucket["rate"]
+                if wait <= 0:
+                    bucket["tokens"] -= 1
+                    self.calls[method] = self.calls.get(method, 0) + 1
+                    bucket["clean_calls"] += 1
+                    if bucket["rate"] < bucket["ceiling"] and bucket["clean_calls"] >= bucket["rate"] * 60:
+                        bucket["rate"] = min(bucket["ceiling"], bucket["rate"] * self.INCREASE)
+                        bucket["clean_calls"] = 0
+                    return
+            time.sleep(wait)
+    
+    def ratelimited(self, method: str, retry_after: float) -> float:
+        """Pause `method` for `retry_after` seconds and slow it down, returns its new calls per minute."""
+        with self.lock:
+            bucket = self._bucket(method)
+            now = time.monotonic()
+            # Calls already in flight when the first rejection came in don't slow it down again
+            if bucket["blocked_until"] <= now:
+                bucket["rate"] = max(self.MIN_RATE, bucket["rate"] * self.DECREASE)
+            # The bucket starts refilling, empty, once the pause is over
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after)
+            bucket["tokens"] = 0.0
+            bucket["updated"] = bucket["blocked_until"]
+            bucket["clean_calls"] = 0
+            return bucket["rate"] * 60
+    
+    def report(self) -> Dict[str, tuple]:
+        """Return {method: (calls, requests_per_second)} for the run so far."""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            return {m: (n, n / elapsed) for m, n in sorted(self.calls.items())}
+
+
+# Upper bounds (seconds) of the API latency histogram buckets, as in Prometheus
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def prometheus_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ExportMetrics:
+    """Counters and timings for one export run, updated from every worker thread.
+    
+    Per API method: calls, errors, error retries, ratelimited responses with
+    their Retry-After total, time spent waiting on the rate-limit scheduler
+    and a latency histogram. Per channel: message count and seconds per
+    stage. ``thread_replies`` and ``downloads`` run on worker pools, so their
+    seconds are summed over workers and can exceed the channel's wall time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.api = {}
+        self.channels = {}
+        self.download_bytes = 0
+    
+    def _method(self, method: str) -> Dict:
+        return self.api.setdefault(method, {
+            "calls": 0, "errors": 0, "retries": 0, "ratelimited": 0,
+            "retry_after_seconds": 0.0, "scheduler_wait_seconds": 0.0,
+            "latency_sum_seconds": 0.0, "latency_counts": [0] * (len(LATENCY_BUCKETS) + 1),
+        })
+    
+    def _channel(self, cname: str) -> Dict:
+        return self.channels.setdefault(cname, {"messages": 0, "seconds": {}})
+    
+    def record_call(self, method: str, latency: float, waited: float, error: Optional[str] = None):
+        """Count one API call, its latency and how long it waited for the scheduler."""
+        with self.lock:
+            stats = self._method(method)
+            stats["calls"] += 1
+            stats["latency_sum_seconds"] += latency
+            stats["latency_counts"][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            stats["scheduler_wait_seconds"] += waited
+            if error:
+                stats["errors"] += 1
+    
+    def record_retry(self, method: str):
+        with self.lock:
+            self._method(method)["retries"] += 1
+    
+    def record_ratelimit(self, method: str, retry_after: float):
+        with self.lock:
+            stats = self._method(method)
+            stats["ratelimited"] += 1
+            stats["retry_after_seconds"] += retry_after
+    
+    def record_download(self, nbytes: int):
+        with self.lock:
+            self.download_bytes += nbytes
+    
+    def record_messages(self, cname: str, count: int):
+        with self.lock:
+            self._channel(cname)["messages"] = count
+    
+    @contextmanager
+    def stage(self, cname: str, name: str):
+        """Add the wall time of the with-block to the channel's ``name`` stage."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                seconds = self._channel(cname)["seconds"]
+                seconds[name] = seconds.get(name, 0.0) + elapsed
+    
+    def timed(self, cname: str, name: str, fn, *args):
+        """Call ``fn(*args)`` inside stage(); for work submitted to a pool."""
+        with self.stage(cname, name):
+            return fn(*args)
+    
+    def as_dict(self) -> Dict:
+        with self.lock:
+            api = {}
+            for method, stats in sorted(self.api.items()):
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats["latency_counts"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                api[method] = {k: v for k, v in stats.items() if k != "latency_counts"}
+                api[method]["latency_buckets"] = buckets
+            channels = {c: {"messages": v["messages"], "seconds": dict(v["seconds"])}
+                        for c, v in sorted(self.channels.items())}
+            finished = time.time()
+            return {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "finished": datetime.fromtimestamp(finished).isoformat(timespec="seconds"),
+                "elapsed_seconds": round(finished - self.started, 3),
+                "api": api,
+                "download_bytes": self.download_bytes,
+                "channels": channels,
+            }
+    
+    @staticmethod
+    def write_json(report: Dict, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def write_prometheus(report: Dict, path: str):
+        """Write the report in the Prometheus text format (for node_exporter's textfile collector)."""
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str, samples: list):
+            lines.append(f"# HELP slack_export_{name} {help_text}")
+            lines.append(f"# TYPE slack_export_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{prometheus_label(v)}"' for k, v in labels.items())
+                lines.append(f"slack_export_{name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"slack_export_{name}{suffix} {value}")
+        
+        api = report["api"]
+        for key, name, help_text in (
+            ("calls", "api_calls_total", "Slack API calls by method."),
+            ("errors", "api_errors_total", "Slack API calls that returned an error."),
+            ("retries", "api_retries_total", "Calls retried after an API error."),
+            ("ratelimited", "api_ratelimited_total", "Calls rejected as ratelimited."),
+            ("retry_after_seconds", "api_retry_after_seconds_total", "Sum of Retry-After on ratelimited calls."),
+            ("scheduler_wait_seconds", "api_scheduler_wait_seconds_total", "Time calls waited for the rate-limit scheduler."),
+        ):
+            metric(name, "counter", help_text, [("", {"method": m}, s[key]) for m, s in api.items()])
+        samples = []
+        for m, s in api.items():
+            samples += [("_bucket", {"method": m, "le": le}, n) for le, n in s["latency_buckets"].items()]
+            samples += [("_sum", {"method": m}, s["latency_sum_seconds"]), ("_count", {"method": m}, s["calls"])]
+        metric("api_latency_seconds", "histogram", "Slack API call latency.", samples)
+        metric("download_bytes_total", "counter", "Attachment bytes downloaded.",
+               [("", {}, report["download_bytes"])])
+        metric("channel_messages", "gauge", "Messages exported per channel.",
+               [("", {"channel": c}, v["messages"]) for c, v in report["channels"].items()])
+        metric("channel_stage_seconds", "gauge", "Seconds spent per channel and export stage.",
+               [("", {"channel": c, "stage": stage}, secs)
+                for c, v in report["channels"].items() for stage, secs in v["seconds"].items()])
+        metric("duration_seconds", "gauge", "Wall time of the last export run.",
+               [("", {}, report["elapsed_seconds"])])
+        metric("last_run_timestamp_seconds", "gauge", "When the last export run finished.",
+               [("", {}, round(time.time()))])
+        
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+class ApiCache:
+    """Slack API results kept in SQLite between runs, keyed by method and parameters.
+    
+    Entries expire after the method's TTL in ``ttls``. An optional
+    validator (e.g. a thread's ``latest_reply``) must also match for a hit.
+    Once the cache grows past ``max_bytes`` the least recently used entries
+    are evicted. With ``refresh`` nothing is read, but fresh results are
+    still stored.
+    """
+    
+    def __init__(self, path: str, max_bytes: int, ttls: Dict[str, float], refresh: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, method TEXT NOT NULL, validator TEXT,"
+            " stored_at REAL NOT NULL, used_at REAL NOT NULL, size INTEGER NOT NULL, body TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._evict()  # The cap may have been lowered since the last run
+        self.db.commit()
+    
+    @staticmethod
+    def key(method: str, params: Dict) -> str:
+        return method + "?" + json.dumps(params, sort_keys=True)
+    
+    def get(self, method: str, params: Dict, validator: Optional[str] = None):
+        """Return the cached result, or None if missing, expired or invalidated."""
+        if self.refresh:
+            return None
+        key = self.key(method, params)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT validator, stored_at, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if not row or now - row[1] > self.ttls.get(method, 0) or row[0] != validator:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+        return json.loads(row[2])
+    
+    def put(self, method: str, params: Dict, value, validator: Optional[str] = None):
+        body = json.dumps(value, ensure_ascii=False)
+        key = self.key(method, params)
+        now = time.time()
+        with self.lock:
+            old = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, method, validator, stored_at, used_at, size, body)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, method, validator, now, now, len(body), body)
+            )
+            self.size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self.db.commit()
+    
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        while self.size > self.max_bytes:
+            rows = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY used_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for key, size in rows:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_bytes:
+                    break
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ArchiveStore:
+    """Every exported message kept in one indexed SQLite database.
+    
+    Messages and thread replies are upserted on (channel, ts) along with
+    their reactions and files, plus channel and user names, so outputs can
+    be rendered again later with ``--render`` without calling Slack. File
+    paths are stored absolute and made relative to the folder rendered into.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channels (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, is_private INTEGER);
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY, name TEXT);
+        CREATE TABLE IF NOT EXISTS messages (
+            channel_id TEXT NOT NULL, ts TEXT NOT NULL, ts_num REAL NOT NULL,
+            in_history INTEGER NOT NULL, parent_ts TEXT, user_id TEXT, text TEXT,
+            reply_count INTEGER, latest_reply TEXT, raw TEXT NOT NULL,
+            PRIMARY KEY (channel_id, ts));
+        CREATE INDEX IF NOT EXISTS messages_by_time ON messages (channel_id, in_history, ts_num);
+        CREATE INDEX IF NOT EXISTS messages_by_thread ON messages (channel_id, parent_ts);
+        CREATE TABLE IF NOT EXISTS reactions (
+            channel_id TEXT NOT NULL, ts TEXT NOT NULL, name TEXT NOT NULL, count INTEGER,
+            PRIMARY KEY (channel_id, ts, name));
+        CREATE TABLE IF NOT EXISTS files (
+            channel_id TEXT NOT NULL, ts TEXT NOT NULL, file_id TEXT NOT NULL,
+            name TEXT, mimetype TEXT, size INTEGER, path TEXT,
+            PRIMARY KEY (channel_id, ts, file_id));
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+    
+    def save_users(self, id_to_name: Dict[str, str]):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO users (id, name) VALUES (?, ?)", id_to_name.items()
+            )
+    
+    def save_channel(self, channel: Dict, messages, export_folder: str):
+        """Upsert a channel's messages (with their ``thread_messages``) in one transaction."""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO channels (id, name, is_private) VALUES (?, ?, ?)",
+                (channel["id"], channel["name"], int(bool(channel.get("is_private"))))
+            )
+            for msg in messages:
+                self._save_message(channel["id"], msg, None, export_folder)
+                for reply in msg.get("thread_messages") or []:
+                    self._save_message(channel["id"], reply, msg["ts"], export_folder)
+    
+    def _save_message(self, channel_id: str, msg: Dict, parent_ts: Optional[str], export_folder: str):
+        raw = {k: v for k, v in msg.items() if k != "thread_messages"}
+        # A reply broadcast to the channel is both in history and in its thread
+        self.db.execute(
+            "INSERT INTO messages (channel_id, ts, ts_num, in_history, parent_ts, user_id, text,"
+            " reply_count, latest_reply, raw) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (channel_id, ts) DO UPDATE SET"
+            " in_history = MAX(in_history, excluded.in_history),"
+            " parent_ts = COALESCE(excluded.parent_ts, parent_ts),"
+            " user_id = excluded.user_id, text = excluded.text, reply_count = excluded.reply_count,"
+            " latest_reply = excluded.latest_reply, raw = excluded.raw",
+            (channel_id, msg["ts"], float(msg["ts"]), int(parent_ts is None), parent_ts,
+             msg.get("user"), msg.get("text", ""), msg.get("reply_count", 0), msg.get("latest_reply"),
+             json.dumps(raw, ensure_ascii=False))
+        )
+        self.db.execute("DELETE FROM reactions WHERE channel_id = ? AND ts = ?", (channel_id, msg["ts"]))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO reactions (channel_id, ts, name, count) VALUES (?, ?, ?, ?)",
+            [(channel_id, msg["ts"], r["name"], r.get("count", 0)) for r in msg.get("reactions") or []]
+        )
+        for f in msg.get("files") or []:
+            path = os.path.join(export_folder, f["local_path"]) if f.get("local_path") else None
+            self.db.execute(
+                "INSERT INTO files (channel_id, ts, file_id, name, mimetype, size, path)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (channel_id, ts, file_id) DO UPDATE SET name = excluded.name,"
+                " mimetype = excluded.mimetype, size = excluded.size, path = COALESCE(excluded.path, path)",
+                (channel_id, msg["ts"], f.get("id") or "", f.get("name"), f.get("mimetype"), f.get("size"),
+                 os.path.abspath(path) if path else None)
+            )
+    
+    def channels(self) -> List[Dict]:
+        with self.lock:
+            rows = self.db.execute("SELECT id, name, is_private FROM channels ORDER BY name").fetchall()
+        return [{"id": r[0], "name": r[1], "is_private": bool(r[2])} for r in rows]
+    
+    def user_names(self) -> Dict[str, str]:
+        with self.lock:
+            return dict(self.db.execute("SELECT id, name FROM users").fetchall())
+    
+    def load_messages(self, channel_id: str, oldest: Optional[float], latest: Optional[float],
+                      export_folder: str) -> List[Dict]:
+        """Messages of a channel in the window, newest first, with their replies attached."""
+        window = (channel_id, oldest if oldest is not None else float("-inf"),
+                  latest if latest is not None else float("inf"))
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT raw FROM messages WHERE channel_id = ? AND in_history = 1"
+                " AND ts_num BETWEEN ? AND ? ORDER BY ts_num DESC", window
+            ).fetchall()
+            reply_rows = self.db.execute(
+                "SELECT r.parent_ts, r.raw FROM messages r JOIN messages p"
+                " ON p.channel_id = r.channel_id AND p.ts = r.parent_ts"
+                " WHERE r.channel_id = ? AND p.in_history = 1 AND p.ts_num BETWEEN ? AND ?"
+                " ORDER BY r.ts_num", window
+            ).fetchall()
+            paths = {
+                (ts, file_id): path for ts, file_id, path in self.db.execute(
+                    "SELECT ts, file_id, path FROM files WHERE channel_id = ? AND path IS NOT NULL", (channel_id,)
+                )
+            }
+        
+        messages = [json.loads(r[0]) for r in rows]
+        by_ts = {m["ts"]: m for m in messages}
+        for parent_ts, raw in reply_rows:
+            by_ts[parent_ts].setdefault("thread_messages", []).append(json.loads(raw))
+        
+        def relink(msg):
+            for f in msg.get("files") or []:
+                path = paths.get((msg["ts"], f.get("id") or ""))
+                if path:
+                    try:
+                        f["local_path"] = os.path.relpath(path, export_folder)
+                    except ValueError:
+                        f["local_path"] = path
+        for msg in messages:
+            relink(msg)
+            for reply in msg.get("thread_messages") or []:
+                relink(reply)
+        return messages
+    
+    def import_shard(self, path: str, shard_folder: str, export_folder: str):
+        """Copy every row of a shard's archive database, moving file paths into export_folder."""
+        old_prefix = os.path.join(os.path.abspath(shard_folder), "")
+        new_prefix = os.path.join(os.path.abspath(export_folder), "")
+        with self.lock:
+            self.db.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                with self.db:
+                    for table in ("channels", "users", "messages", "reactions"):
+                        self.db.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM shard.{table}")
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO main.files (channel_id, ts, file_id, name, mimetype, size, path)"
+                        " SELECT channel_id, ts, file_id, name, mimetype, size,"
+                        " CASE WHEN substr(path, 1, ?) = ? THEN ? || substr(path, ?) ELSE path END"
+                        " FROM shard.files",
+                        (len(old_prefix), old_prefix, new_prefix, len(old_prefix) + 1)
+                    )
+            finally:
+                self.db.execute("DETACH DATABASE shard")
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SearchIndex:
+    """SQLite FTS5 index over the cleaned (anonymized) text of exported messages.
+    
+    One row per (channel, ts) holds the cleaned text, the anonymous author
+    and the export folder whose anonymization key applies. Rows are upserted
+    as channels are written, and only rewritten when the text or author
+    changed, so repeated incremental exports stay cheap.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY, channel_id TEXT NOT NULL, channel TEXT NOT NULL,
+            ts TEXT NOT NULL, ts_num REAL NOT NULL, thread_ts TEXT, author TEXT,
+            export TEXT, text TEXT NOT NULL, UNIQUE (channel_id, ts));
+        CREATE INDEX IF NOT EXISTS entries_by_thread ON entries (channel_id, thread_ts);
+        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+            text, content='entries', content_rowid='id', tokenize='unicode61');
+        CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+            INSERT INTO entries_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+            INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN
+            INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO entries_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+    THREAD_CONTEXT = 10  # Messages of a hit's thread shown with it
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+    
+    def add(self, channel_id: str, cname: str, export: str, prepared: List):
+        """Upsert a batch of PreparedMessages (and their replies) in one transaction."""
+        rows = []
+        for msg in prepared:
+            thread_ts = msg.raw["ts"] if msg.replies else msg.raw.get("thread_ts")
+            rows.append((msg, thread_ts))
+            rows.extend((reply, msg.raw["ts"]) for reply in msg.replies)
+        self._upsert([(channel_id, cname, m.raw["ts"], float(m.raw["ts"]), thread_ts, m.anon, export, m.text)
+                      for m, thread_ts in rows])
+    
+    def _upsert(self, rows: List[tuple]):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT INTO entries (channel_id, channel, ts, ts_num, thread_ts, author, export, text)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (channel_id, ts) DO UPDATE SET channel = excluded.channel,"
+                " thread_ts = excluded.thread_ts, author = excluded.author, export = excluded.export,"
+                " text = excluded.text"
+                " WHERE text IS NOT excluded.text OR author IS NOT excluded.author OR export IS NOT excluded.export",
+                rows
+            )
+    
+    def import_shard(self, path: str, export: str, rename: Dict[str, str]):
+        """Add a shard's index entries under the merged export, with anon IDs mapped through rename."""
+        sub = lambda m: rename.get(m.group(0), m.group(0))
+        shard = sqlite3.connect(path)
+        try:
+            cursor = shard.execute(
+                "SELECT channel_id, channel, ts, ts_num, thread_ts, author, text FROM entries"
+            )
+            while True:
+                batch = cursor.fetchmany(SEARCH_INDEX_BATCH)
+                if not batch:
+                    break
+                self._upsert([(channel_id, cname, ts, ts_num, thread_ts, rename.get(author, author),
+                               export, ANON_ID_RE.sub(sub, text))
+                              for channel_id, cname, ts, ts_num, thread_ts, author, text in batch])
+        finally:
+            shard.close()
+    
+    def search(self, query: str, channels: Optional[List[str]] = None, author: Optional[str] = None,
+               oldest: Optional[float] = None, latest: Optional[float] = None, limit: int = 20) -> List[Dict]:
+        """Best matches for an FTS5 query, each with the messages of its thread."""
+        sql = ("SELECT e.channel_id, e.channel, e.ts, e.thread_ts, e.author, e.export,"
+               " snippet(entries_fts, 0, '[', ']', '…', 16)"
+               " FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid WHERE entries_fts MATCH ?")
+        params = [query]
+        if channels:
+            names = [c.lstrip("#") for c in channels]
+            marks = ", ".join("?" * len(names))
+            sql += f" AND (e.channel IN ({marks}) OR e.channel_id IN ({marks}))"
+            params += names + names
+        if author:
+            sql += " AND e.author = ?"
+            params.append(author)
+        if oldest is not None:
+            sql += " AND e.ts_num >= ?"
+            params.append(oldest)
+        if latest is not None:
+            sql += " AND e.ts_num <= ?"
+            params.append(latest)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        
+        hits = []
+        with self.lock:
+            for channel_id, cname, ts, thread_ts, anon, export, snippet in self.db.execute(sql, params).fetchall():
+                thread = []
+                if thread_ts:
+                    thread = self.db.execute(
+                        "SELECT ts, author, text FROM entries WHERE channel_id = ? AND (thread_ts = ? OR ts = ?)"
+                        " ORDER BY ts_num LIMIT ?", (channel_id, thread_ts, thread_ts, self.THREAD_CONTEXT)
+                    ).fetchall()
+                hits.append({"channel": cname, "ts": ts, "author": anon, "export": export,
+                             "snippet": snippet, "thread": thread})
+        return hits
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ExportState:
+    """High-water marks for incremental exports, persisted as JSON in the archive folder.
+
+    For every channel it records the newest exported message ``ts`` and the
+    ``latest_reply`` of each thread that is still considered active, plus the
+    anonymization map so aliases stay the same from one run to the next.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"version": 1, "channels": {}, "anon_map": {}}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+    
+    def channel(self, channel_id: str) -> Dict:
+        """Return the saved state for a channel (empty if never exported)."""
+        with self.lock:
+            return dict(self.data["channels"].get(channel_id, {}))
+    
+    def update_channel(self, channel_id: str, entry: Dict):
+        """Record a channel's new high-water marks and persist immediately."""
+        with self.lock:
+            self.data["channels"][channel_id] = entry
+            self._save()
+    
+    def anon_map(self) -> Dict[str, str]:
+        with self.lock:
+            return dict(self.data.get("anon_map", {}))
+    
+    def update_anon_map(self, anon_map: Dict[str, str]):
+        with self.lock:
+            self.data["anon_map"] = dict(anon_map)
+            self._save()
+    
+    def _save(self):
+        # Write to a temp file first so an interrupted run never corrupts the state
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class DownloadQueue:
+    """Bounded pool for attachment downloads, shared by all channels.
+    
+    At most ``per_host`` downloads talk to the same host at once, and a
+    throughput readout (files/sec, MB/sec) is printed as files complete.
+    Files linked from the blob store are counted as ``deduplicated`` and
+    kept out of the throughput figures.
+    """
+    REPORT_EVERY_SECONDS = 10
+    
+    def __init__(self, workers: int, per_host: int):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="downloads")
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.files = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.bytes = 0
+        self.started = None
+        self.last_report = 0.0
+    
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+        return self.pool.submit(fn, *args)
+    
+    def host_slot(self, url: str) -> threading.Semaphore:
+        """Semaphore limiting concurrent downloads from the URL's host."""
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.Semaphore(self.per_host)
+            return self.host_slots[host]
+    
+    def record(self, nbytes: Optional[int], deduplicated: bool = False):
+        """Count a finished download (None for a failure) and print progress now and then."""
+        with self.lock:
+            if nbytes is None:
+                self.failed += 1
+            elif deduplicated:
+                self.deduplicated += 1
+            else:
+                self.files += 1
+                self.bytes += nbytes
+            now = time.monotonic()
+            if now - self.last_report < self.REPORT_EVERY_SECONDS:
+                return
+            self.last_report = now
+        print(f"   📥 {self.progress_line()}")
+    
+    def progress_line(self) -> str:
+        files, mbytes, elapsed = self.files, self.bytes / 1024 / 1024, self.elapsed()
+        return (f"{files} files, {mbytes:.1f} MB downloaded "
+                f"({files / elapsed:.1f} files/s, {mbytes / elapsed:.2f} MB/s)")
+    
+    def elapsed(self) -> float:
+        return max(time.monotonic() - (self.started or time.monotonic()), 1e-6)
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+class BlobStore:
+    """Content-addressed attachment store shared by every export folder.
+    
+    Blobs are stored once under ``blobs/<sha256[:2]>/<sha256>``. ``index.ndjson``
+    maps Slack file IDs to their blob, so a file that is already stored with
+    a matching size is linked into a new export without touching the network,
+    and identical content shared under different file IDs is kept only once.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, "index.ndjson")
+        self.lock = threading.Lock()
+        self.by_id = {}
+        self.file_locks = {}
+        self.hits = 0
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.by_id[entry["file_id"]] = entry
+    
+    def file_lock(self, file_id: str) -> threading.Lock:
+        """Lock held while a file ID is looked up and downloaded, so channels sharing
+        the same file don't download it concurrently."""
+        with self.lock:
+            return self.file_locks.setdefault(file_id, threading.Lock())
+    
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+    
+    def lookup(self, file_id: Optional[str], size: int) -> Optional[str]:
+        """Return the stored blob for a Slack file ID if its size still matches."""
+        with self.lock:
+            entry = self.by_id.get(file_id) if file_id else None
+            if not entry or (size and entry["size"] != size):
+                return None
+            path = self.blob_path(entry["sha256"])
+            if not os.path.exists(path):
+                return None
+            self.hits += 1
+            return path
+    
+    def add(self, file_id: Optional[str], part_path: str, digest: str) -> str:
+        """Move a finished download into the store (or drop it if the content exists)."""
+        path = self.blob_path(digest)
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(part_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.move(part_path, path)
+            if file_id and self.by_id.get(file_id, {}).get("sha256") != digest:
+                entry = {"file_id": file_id, "sha256": digest, "size": os.path.getsize(path)}
+                self.by_id[file_id] = entry
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return path
+    
+    @staticmethod
+    def place(blob_path: str, local_path: str, link_mode: str) -> str:
+        """Expose a blob at `local_path` and return the path the export should reference.
+        
+        ``hardlink`` links the blob into the channel folder (copying if the
+        filesystem can't link); ``manifest`` references the blob directly.
+        """
+        if link_mode == "manifest":
+            return blob_path
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        try:
+            os.link(blob_path, local_path)
+        except OSError:
+            shutil.copy2(blob_path, local_path)
+        return local_path
+
+
+class UrlRefresher:
+    """Fresh attachment URLs from files.info, looked up at most once per file ID.
+
+    Messages already carry download URLs, so this is only asked when one of
+    them has gone stale. Workers refreshing the same file wait for a single
+    lookup instead of each spending files.info budget.
+    """
+    
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.lock = threading.Lock()
+        self.file_locks = {}
+        self.urls = {}
+        self.calls = 0
+    
+    def refresh(self, file_id: Optional[str]) -> List[str]:
+        if not file_id:
+            return []
+        with self.lock:
+            file_lock = self.file_locks.setdefault(file_id, threading.Lock())
+        with file_lock:
+            if file_id not in self.urls:
+                urls = []
+                try:
+                    details = self.lookup(file_id).get("file", {})
+                    urls = [u for u in (details.get("url_private_download"), details.get("url_private")) if u]
+                    logger.debug(f"Got fresh URL for file {file_id} via API")
+                except Exception as e:
+                    logger.warning(f"Could not refresh URL for file {file_id}: {e}")
+                with self.lock:
+                    self.calls += 1
+                    self.urls[file_id] = urls
+            return self.urls[file_id]
+
+
+class UserResolver:
+    """Display names of the users an export actually meets, looked up on demand.
+
+    Each new user ID is handed to ``prefetch`` when it is first anonymized and
+    looked up in the background (users.info, Tier 4) while the export goes on.
+    Once more than ``max_lookups`` IDs have been asked for, paging through
+    users.list is cheaper, so ``overflowed`` is set and no more lookups start.
+    """
+    
+    def __init__(self, lookup, workers: int, max_lookups: int):
+        self.lookup = lookup
+        self.max_lookups = max_lookups
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="users")
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.names = {}
+        self.overflowed = False
+    
+    def prefetch(self, uid: str):
+        with self.lock:
+            if uid in self.futures or self.overflowed or not USER_ID_RE.fullmatch(uid):
+                return
+            if len(self.futures) >= self.max_lookups:
+                self.overflowed = True
+                for future in self.futures.values():
+                    future.cancel()
+                logger.info(f"More than {self.max_lookups} users to look up, switching to users.list")
+                return
+            self.futures[uid] = self.pool.submit(self._fetch, uid)
+    
+    def _fetch(self, uid: str):
+        try:
+            name = self.lookup(uid)
+        except Exception as e:
+            logger.warning(f"Could not look up user {uid}: {e}")
+            return
+        if name:
+            with self.lock:
+                self.names[uid] = name
+    
+    def resolve(self, uids) -> Dict[str, str]:
+        """Wait for the lookups of `uids` (starting any not asked for yet), returns the names found."""
+        for uid in uids:
+            self.prefetch(uid)
+        with self.lock:
+            futures = [self.futures[uid] for uid in uids if uid in self.futures]
+        wait(futures)
+        with self.lock:
+            return {uid: self.names[uid] for uid in uids if uid in self.names}
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+class MessageSpool:
+    """A channel's messages kept on disk as NDJSON instead of in a Python list.
+    
+    Lines are in conversations.history order (newest first), so iterating
+    gives newest first and ``reversed()`` gives chronological order, read
+    backwards in blocks so memory stays flat however large the channel is.
+    Pages are appended by the checkpoint; ``extend`` only keeps the counts.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.thread_count = 0
+        if os.path.exists(path):
+            for msg in self:
+                self._tally(msg)
+    
+    def _tally(self, msg: Dict):
+        self.count += 1
+        if msg.get("thread_messages"):
+            self.thread_count += 1
+    
+    def extend(self, batch: List[Dict]):
+        for msg in batch:
+            self._tally(msg)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __iter__(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    
+    def __reversed__(self):
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            tail = b""
+            while pos > 0:
+                size = min(SPOOL_BLOCK_SIZE, pos)
+                pos -= size
+                f.seek(pos)
+                lines = (f.read(size) + tail).split(b"\n")
+                # The first piece may be the end of a line that started in an earlier block
+                tail = lines[0]
+                for line in reversed(lines[1:]):
+                    if line.strip():
+                        yield json.loads(line)
+            if tail.strip():
+                yield json.loads(tail)
+
+
+def iter_json_array(f):
+    """Yield the elements of a JSON array file one at a time, without loading the whole array."""
+    decoder = json.JSONDecoder()
+    buf = f.read(SPOOL_BLOCK_SIZE).lstrip()
+    if not buf:
+        return
+    if buf[0] != "[":
+        raise ValueError("Expected a JSON array")
+    pos = 1
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+            pos += 1
+        if pos == len(buf):
+            buf, pos = f.read(SPOOL_BLOCK_SIZE), 0
+            if not buf:
+                raise ValueError("Unterminated JSON array")
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # The element runs past the end of the buffer, read on
+            more = f.read(SPOOL_BLOCK_SIZE)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield element
+        pos = end
+
+
+class MergedMessages:
+    """Archived messages in a MessageSpool merged with fetched ones held in memory.
+    
+    Both are newest first. Iterating yields the merged list newest first and
+    ``reversed()`` chronologically, without reading the archive into memory.
+    """
+    def __init__(self, archived: MessageSpool, fetched: List[Dict]):
+        self.archived = archived
+        self.fetched = sorted(fetched, key=lambda m: float(m["ts"]), reverse=True)
+    
+    def __len__(self) -> int:
+        return len(self.archived) + len(self.fetched)
+    
+    def __iter__(self):
+        return heapq.merge(self.archived, self.fetched, key=lambda m: float(m["ts"]), reverse=True)
+    
+    def __reversed__(self):
+        return heapq.merge(reversed(self.archived), reversed(self.fetched), key=lambda m: float(m["ts"]))
+
+
+# === OUTPUT WRITERS ===
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+SEARCH_INDEX_BATCH = 1000  # Prepared messages per search index transaction
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+DEFAULT_COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+COLUMNAR_BATCH_ROWS = 50000  # Rows per Parquet row group / Arrow record batch
+
+
+def compression_of(path: str) -> str:
+    """The compression of an output file, from its suffix."""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return "none"
+
+
+def open_output(path: str, mode: str, compression: str = "none", level: Optional[int] = None,
+                newline: Optional[str] = None):
+    """Open a UTF-8 text output ("rt", "wt" or "at"), gzip- or zstd-compressed if asked."""
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS.get(compression)
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=level, encoding="utf-8", newline=newline)
+    if compression == "zstd":
+        cctx = zstandard.ZstdCompressor(level=level) if "r" not in mode else None
+        return zstandard.open(path, mode, cctx=cctx, encoding="utf-8", newline=newline)
+    return open(path, mode, encoding="utf-8", newline=newline, buffering=OUTPUT_BUFFER_SIZE)
+
+
+def find_output(base_path: str, preferred: str = "none") -> Optional[str]:
+    """The existing output at base_path, with whatever compression it was written with."""
+    suffixes = [COMPRESSION_SUFFIXES[preferred]] + list(COMPRESSION_SUFFIXES.values())
+    for suffix in suffixes:
+        if os.path.exists(base_path + suffix):
+            return base_path + suffix
+    return None
+
+
+class PreparedMessage:
+    """What every writer needs from one message, worked out once per message."""
+    __slots__ = ("raw", "anon", "ts", "text", "markdown", "replies")
+    
+    def __init__(self, raw: Dict, anon: str, ts: str, text: str, markdown: str, replies: list):
+        self.raw = raw
+        self.anon = anon
+        self.ts = ts
+        self.text = text
+        self.markdown = markdown
+        self.replies = replies
+
+
+class OutputWriter:
+    """One output file of a channel, fed prepared messages in chronological order.
+    
+    Subclasses set ``suffix``/``label`` and implement ``write``, or set
+    ``newest_first`` and implement ``write_raw`` to get the raw messages in
+    conversations.history order (newest first) instead. Output goes
+    to a buffered (optionally compressed) temp file that replaces the real
+    one on ``close``, so a failed render never leaves a half-written file behind.
+    ``appendable`` writers can instead add messages to the end of an existing
+    file; ``abort`` then cuts it back to its old size.
+    """
+    suffix = ""
+    label = ""
+    newest_first = False
+    appendable = False
+    
+    def __init__(self, path: str, cname: str, include_reactions: bool = True,
+                 compression: str = "none", level: Optional[int] = None, append: bool = False):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.include_reactions = include_reactions
+        self.appending = append
+        if append:
+            self.append_from = os.path.getsize(path)
+            self.f = open_output(path, "at", compression, level)
+        else:
+            self.f = open_output(path + ".tmp", "wt", compression, level)
+            self.begin(cname)
+    
+    def begin(self, cname: str):
+        pass
+    
+    def write(self, msg: PreparedMessage):
+        raise NotImplementedError
+    
+    def write_raw(self, raw: Dict):
+        raise NotImplementedError
+    
+    def end(self):
+        pass
+    
+    def close(self):
+        if self.appending:
+            self.f.close()
+            return
+        self.end()
+        self.f.close()
+        os.replace(self.path + ".tmp", self.path)
+    
+    def abort(self):
+        self.f.close()
+        if self.appending:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.append_from)
+        elif os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+
+class TextWriter(OutputWriter):
+    suffix = ".txt"
+    label = "TXT"
+    appendable = True
+    
+    @staticmethod
+    def format(msg: PreparedMessage, indent: int = 0, include_reactions: bool = True) -> str:
+        prefix = "  " * indent
+        output = f"{prefix}{msg.anon} [{msg.ts}]: {msg.text}"
+        
+        if include_reactions and msg.raw.get("reactions"):
+            reactions = ", ".join([f":{r['name']}:{r['count']}" for r in msg.raw["reactions"]])
+            output += f"\n{prefix}  Reactions: {reactions}"
+        
+        for f in msg.raw.get("files") or []:
+            fname = f.get('name', 'unnamed')
+            ftype = f.get('mimetype', 'unknown')
+            local_path = f.get('local_path')
+            if local_path:
+                output += f"\n{prefix}  📎 File: {fname} ({ftype}) [Saved to: {local_path}]"
+            else:
+                output += f"\n{prefix}  📎 File: {fname} ({ftype})"
+        return output
+    
+    def write(self, msg: PreparedMessage):
+        self.f.write(self.format(msg, 0, self.include_reactions) + "\n")
+        
+        # Write thread replies with indentation
+        if msg.replies:
+            self.f.write(f"  ↳ Thread ({len(msg.replies)} replies):\n")
+            for reply in msg.replies:
+                self.f.write(self.format(reply, 2, self.include_reactions) + "\n")
+        
+        self.f.write("\n")
+
+
+class MarkdownWriter(OutputWriter):
+    suffix = ".md"
+    label = "MD"
+    appendable = True
+    
+    @staticmethod
+    def format(msg: PreparedMessage, indent: int = 0, include_reactions: bool = True) -> str:
+        prefix = "  " * indent
+        output = f"{prefix}**{msg.anon}** [{msg.ts}]: {msg.markdown}\n"
+        
+        if include_reactions and msg.raw.get("reactions"):
+            reactions = " ".join([f":{r['name']}:" for r in msg.raw["reactions"]])
+            output += f"{prefix}*Reactions: {reactions}*\n"
+        
+        for f in msg.raw.get("files") or []:
+            fname = f.get('name', 'unnamed')
+            ftype = f.get('mimetype', 'unknown')
+            local_path = f.get('local_path')
+            if local_path:
+                output += f"{prefix}📎 [{fname}]({local_path}) ({ftype})\n"
+            else:
+                output += f"{prefix}📎 {fname} ({ftype})\n"
+        return output
+    
+    def begin(self, cname: str):
+        self.f.write(f"# Channel: #{cname}\n\n")
+        self.f.write(f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        self.f.write("---\n\n")
+    
+    def write(self, msg: PreparedMessage):
+        self.f.write(self.format(msg, 0, self.include_reactions))
+        
+        if msg.replies:
+            self.f.write(f"  *↳ Thread ({len(msg.replies)} replies):*\n\n")
+            for reply in msg.replies:
+                self.f.write(self.format(reply, 2, self.include_reactions))
+        
+        self.f.write("\n")
+
+
+class JsonWriter(OutputWriter):
+    """A JSON array laid out like ``json.dump(..., indent=2)``, one element at a time.
+    
+    Messages stay in API order (newest first), as JSON exports always had them.
+    """
+    suffix = ".json"
+    label = "JSON"
+    newest_first = True
+    
+    def begin(self, cname: str):
+        self.first = True
+    
+    def write_raw(self, raw: Dict):
+        self.f.write("[\n  " if self.first else ",\n  ")
+        self.f.write(json.dumps(raw, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+        self.first = False
+    
+    def end(self):
+        self.f.write("[]" if self.first else "\n]")
+
+
+class CompactJsonWriter(JsonWriter):
+    """A JSON array with one unindented message per line."""
+    
+    def write_raw(self, raw: Dict):
+        self.f.write("[\n" if self.first else ",\n")
+        self.f.write(json.dumps(raw, ensure_ascii=False, separators=(",", ":")))
+        self.first = False
+
+
+class NdjsonWriter(OutputWriter):
+    suffix = ".ndjson"
+    label = "NDJSON"
+    newest_first = True
+    
+    def write_raw(self, raw: Dict):
+        self.f.write(json.dumps(raw, ensure_ascii=False) + "\n")
+
+
+class ColumnarWriter(OutputWriter):
+    """Messages and thread replies as rows of a Parquet table, for analytics tools.
+    
+    One row per message or reply with the channel, ts, thread_ts, anonymous
+    user, cleaned text, reactions and file references. Rows are written in
+    groups of COLUMNAR_BATCH_ROWS, so memory stays bounded on big channels.
+    """
+    suffix = ".parquet"
+    label = "Parquet"
+    
+    def __init__(self, path: str, cname: str, include_reactions: bool = True,
+                 compression: str = "none", level: Optional[int] = None, append: bool = False):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.cname = cname
+        self.appending = False
+        self.include_reactions = include_reactions
+        self.schema = self.table_schema()
+        self.columns = {name: [] for name in self.schema.names}
+        self.writer = None
+    
+    @staticmethod
+    def table_schema():
+        file_ref = pyarrow.struct([("id", pyarrow.string()), ("name", pyarrow.string()), ("path", pyarrow.string())])
+        reaction = pyarrow.struct([("name", pyarrow.string()), ("count", pyarrow.int32())])
+        return pyarrow.schema([
+            ("channel", pyarrow.string()),
+            ("ts", pyarrow.string()),
+            ("time", pyarrow.timestamp("us", tz="UTC")),
+            ("thread_ts", pyarrow.string()),
+            ("is_reply", pyarrow.bool_()),
+            ("user", pyarrow.string()),
+            ("text", pyarrow.string()),
+            ("reply_count", pyarrow.int32()),
+            ("reaction_count", pyarrow.int32()),
+            ("reactions", pyarrow.list_(reaction)),
+            ("files", pyarrow.list_(file_ref)),
+        ])
+    
+    def open_writer(self, path: str):
+        return pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+    
+    def write(self, msg: PreparedMessage):
+        self.add_row(msg, None)
+        for reply in msg.replies:
+            self.add_row(reply, msg.raw["ts"])
+        if len(self.columns["ts"]) >= COLUMNAR_BATCH_ROWS:
+            self.flush()
+    
+    def add_row(self, msg: PreparedMessage, parent_ts: Optional[str]):
+        raw = msg.raw
+        reactions = [{"name": r["name"], "count": r.get("count", 0)}
+                     for r in raw.get("reactions") or []] if self.include_reactions else []
+        row = {
+            "channel": self.cname,
+            "ts": raw["ts"],
+            "time": datetime.fromtimestamp(float(raw["ts"]), tz=timezone.utc),
+            "thread_ts": parent_ts or (raw["ts"] if msg.replies else raw.get("thread_ts")),
+            "is_reply": parent_ts is not None,
+            "user": msg.anon,
+            "text": msg.text,
+            "reply_count": raw.get("reply_count", 0),
+            "reaction_count": sum(r["count"] for r in reactions),
+            "reactions": reactions,
+            "files": [{"id": f.get("id"), "name": f.get("name"), "path": f.get("local_path")}
+                      for f in raw.get("files") or []],
+        }
+        for name, value in row.items():
+            self.columns[name].append(value)
+    
+    def flush(self):
+        if self.writer is None:
+            self.writer = self.open_writer(self.path + ".tmp")
+        self.writer.write_table(pyarrow.Table.from_pydict(self.columns, schema=self.schema))
+        for values in self.columns.values():
+            values.clear()
+    
+    def close(self):
+        if self.columns["ts"] or self.writer is None:
+            self.flush()
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+    
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+
+class ArrowWriter(ColumnarWriter):
+    """The same table as an Arrow IPC file, memory-mappable without decoding."""
+    suffix = ".arrow"
+    label = "Arrow"
+    
+    def open_writer(self, path: str):
+        return pyarrow.ipc.new_file(path, self.schema)
+
+
+class Checkpoint:
+    """On-disk progress of a running export, used to continue it with --resume.
+    
+    ``checkpoint.json`` holds the run settings, finished channels and the
+    anonymization map. For each channel in progress, committed history pages
+    (including their thread replies) are appended to ``<channel_id>.ndjson``
+    and the cursor of the next page is kept in ``<channel_id>.json``.
+    Completed attachment downloads are appended to ``downloads.ndjson``.
+    """
+    def __init__(self, export_folder: str):
+        self.dir = os.path.join(export_folder, CHECKPOINT_DIRNAME)
+        self.path = os.path.join(self.dir, "checkpoint.json")
+        self.downloads_path = os.path.join(self.dir, "downloads.ndjson")
+        self.lock = threading.Lock()
+        self.data = {"version": 1, "settings": {}, "completed": {}, "anon_map": {}}
+        self.downloads = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        if os.path.exists(self.downloads_path):
+            with open(self.downloads_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.downloads[entry["key"]] = entry["local_path"]
+    
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+    
+    @property
+    def settings(self) -> Dict:
+        return self.data["settings"]
+    
+    def start(self, settings: Dict):
+        """Begin a new checkpoint for an export run with the given settings."""
+        os.makedirs(self.dir, exist_ok=True)
+        with self.lock:
+            self.data["settings"] = settings
+            self._save()
+    
+    def completed(self) -> Dict[str, tuple]:
+        """Results of channels that finished in an earlier attempt."""
+        with self.lock:
+            return {cid: tuple(result) for cid, result in self.data["completed"].items()}
+    
+    def anon_map(self) -> Dict[str, str]:
+        with self.lock:
+            return dict(self.data.get("anon_map", {}))
+    
+    def complete_channel(self, channel_id: str, result: tuple, anon_map: Dict[str, str]):
+        """Mark a channel as exported and drop its page spool."""
+        with self.lock:
+            self.data["completed"][channel_id] = list(result)
+            self.data["anon_map"] = dict(anon_map)
+            self._save()
+        for suffix in (".ndjson", ".json"):
+            path = os.path.join(self.dir, channel_id + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def channel_progress(self, channel_id: str) -> Dict:
+        """Return {"cursor", "done", "offset"} for a channel, empty if not started."""
+        path = os.path.join(self.dir, channel_id + ".json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def load_messages(self, channel_id: str) -> List[Dict]:
+        """Read back the pages committed so far for a channel."""
+        spool = self.open_spool(channel_id)
+        return list(spool) if os.path.exists(spool.path) else []
+    
+    def open_spool(self, channel_id: str) -> MessageSpool:
+        """Return the channel's page spool, trimmed to the last committed page."""
+        progress = self.channel_progress(channel_id)
+        spool_path = os.path.join(self.dir, channel_id + ".ndjson")
+        if os.path.exists(spool_path):
+            # Anything past the recorded offset was written after the last cursor save
+            with open(spool_path, "r+b") as f:
+                f.truncate(progress.get("offset", 0))
+        return MessageSpool(spool_path)
+    
+    def commit_page(self, channel_id: str, batch: List[Dict], next_cursor: Optional[str], done: bool):
+        """Append a finished history page to the spool, then save the next cursor."""
+        spool_path = os.path.join(self.dir, channel_id + ".ndjson")
+        with open(spool_path, "a", encoding="utf-8") as f:
+            for msg in batch:
+                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            f.flush()
+            offset = f.tell()
+        progress_path = os.path.join(self.dir, channel_id + ".json")
+        with open(progress_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"cursor": next_cursor, "done": done, "offset": offset}, f)
+        os.replace(progress_path + ".tmp", progress_path)
+    
+    def downloaded(self, key: str) -> Optional[str]:
+        with self.lock:
+            return self.downloads.get(key)
+    
+    def record_download(self, key: str, local_path: str):
+        with self.lock:
+            self.downloads[key] = local_path
+            with open(self.downloads_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "local_path": local_path}) + "\n")
+    
+    def clear(self):
+        """Remove the checkpoint (after a complete run, or before starting a new one)."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        with self.lock:
+            self.data = {"version": 1, "settings": {}, "completed": {}, "anon_map": {}}
+            self.downloads = {}
+    
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
 
-if not HAS_REQUESTS and DOWNLOAD_FILES:
-    print("⚠️  'requests' library not found. File downloads will be disabled.")
-    print("   Install with: pip install requests\n")
-    DOWNLOAD_FILES = False
 
 class SlackExporter:
-    def __init__(self, token: str, export_folder: str):
+    """Exports channels of one workspace into ``export_folder``.
+    
+    Usable as a library: build ExportSettings (or pass None for defaults),
+    then call load_users(), get_channels() and export_channel() for the
+    channels you want, and close() when done.
+    """
+    def __init__(self, token: str, export_folder: str, scheduler: Optional[RateLimitScheduler] = None,
+                 settings: Optional[ExportSettings] = None):
+        self.settings = settings = settings or ExportSettings()
         self.client = WebClient(token=token)
         self.export_folder = export_folder
+        os.makedirs(export_folder, exist_ok=True)
+        self.scheduler = scheduler or RateLimitScheduler(settings.rate_limit_delay)
+        self.metrics = ExportMetrics()
+        self.checkpoint = None
         self.id_to_name = {}
+        self.user_resolver = None  # Set by load_users when names are looked up on demand
+        if settings.compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"output.compression must be one of {', '.join(COMPRESSION_SUFFIXES)}, "
+                             f"got {settings.compression!r}")
+        if settings.compression == "zstd" and not HAS_ZSTD:
+            raise ValueError("zstd compression needs the zstandard package: pip install zstandard")
+        if settings.columnar not in (None, "parquet", "arrow"):
+            raise ValueError(f'output.columnar must be "parquet", "arrow" or null, got {settings.columnar!r}')
+        if settings.columnar and not HAS_PYARROW:
+            raise ValueError(f"{settings.columnar} output needs the pyarrow package: pip install pyarrow")
+        self.projection = None
+        if isinstance(settings.message_fields, str) and settings.message_fields != "full":
+            raise ValueError(f'projection.fields must be "full" or a list of field names, '
+                             f'got {settings.message_fields!r}')
+        if settings.message_fields != "full":
+            # Every output lists file references, trimmed to PROJECTION_FILE_FIELDS
+            self.projection = PROJECTION_REQUIRED_FIELDS | frozenset(settings.message_fields) | {"files"}
+            if settings.include_reactions:
+                self.projection |= {"reactions"}
+        # Filled with the matching user IDs once the user list is loaded
+        self.excluded_users = set(settings.exclude_users)
         self.anon_map = {}
         self.anon_counter = 1
+        self.anon_lock = threading.Lock()
+        self.pseudonym_key = load_pseudonym_key(settings) if settings.pseudonyms == "keyed" else None
+        # Text and markdown rendering of the same message share one sanitizing pass
+        self.clean_cached = lru_cache(maxsize=CLEAN_CACHE_SIZE)(self._sanitize)
+        # Shared by all channel workers so reply fetching stays bounded overall
+        self.reply_pool = ThreadPoolExecutor(max_workers=settings.thread_workers, thread_name_prefix="replies")
+        self.http = self._create_http_session(token, settings.download_pool_size) if HAS_REQUESTS else None
+        self.downloads = DownloadQueue(settings.download_workers, settings.download_per_host)
+        self.blob_store = (BlobStore(settings.blob_store_dir)
+                           if settings.blob_store and settings.download_files else None)
+        self.cache = (ApiCache(settings.cache_path, settings.cache_max_bytes, settings.cache_ttls,
+                               settings.cache_refresh)
+                      if settings.cache_enabled else None)
+        self.archive = ArchiveStore(settings.archive_db_path) if settings.archive_db else None
+        self.search_index = SearchIndex(settings.search_index_path) if settings.search_index else None
+        self.url_refresher = UrlRefresher(
+            lambda file_id: self.retry_api_call(self.client.files_info, file=file_id)
+        )
+    
+    @staticmethod
+    def _create_http_session(token: str, pool_size: int):
+        """Keep-alive session for file downloads, reused across all attachments."""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        })
+        return session
+    
+    def close(self):
+        """Shut down background worker pools and the download session."""
+        self.reply_pool.shutdown(wait=False)
+        self.downloads.shutdown()
+        if self.user_resolver:
+            self.user_resolver.shutdown()
+        if self.http is not None:
+            self.http.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.search_index is not None:
+            self.search_index.close()
+    
+    def write_metrics(self) -> Optional[str]:
+        """Write metrics.json to the export folder (and the Prometheus textfile, if configured).
+        
+        Returns the metrics.json path, or None if metrics are disabled.
+        """
+        report = self.metrics.as_dict()
+        report["downloads"] = {
+            "files": self.downloads.files,
+            "failed": self.downloads.failed,
+            "deduplicated": self.downloads.deduplicated,
+            "bytes_downloaded": self.downloads.bytes,
+            "blob_store_hits": self.blob_store.hits if self.blob_store else 0,
+            "url_refreshes": self.url_refresher.calls,
+        }
+        if self.cache:
+            report["cache"] = {"hits": self.cache.hits, "misses": self.cache.misses}
+        
+        path = None
+        if self.settings.metrics_enabled:
+            path = os.path.join(self.export_folder, METRICS_FILENAME)
+            ExportMetrics.write_json(report, path)
+        if self.settings.prometheus_textfile:
+            ExportMetrics.write_prometheus(report, self.settings.prometheus_textfile)
+        return path
         
     def retry_api_call(self, func, *args, **kwargs):
-        """Retry API calls with exponential backoff."""
-        for attempt in range(MAX_RETRIES):
+        """Retry API errors with exponential backoff, paced by the shared scheduler.
+        
+        Ratelimited responses are waited out (up to MAX_RATELIMIT_WAITS in a
+        row) without counting against ``max_retries``.
+        """
+        method = api_method_name(func)
+        max_retries = self.settings.max_retries
+        attempt = ratelimits = 0
+        while True:
+            waited = time.monotonic()
+            self.scheduler.acquire(method)
+            started = time.monotonic()
             try:
-                return func(*args, **kwargs)
+                resp = func(*args, **kwargs)
+                self.metrics.record_call(method, time.monotonic() - started, started - waited)
+                return resp
             except SlackApiError as e:
+                self.metrics.record_call(method, time.monotonic() - started, started - waited, e.response["error"])
                 if e.response["error"] == "ratelimited":
-                    wait_time = int(e.response.headers.get("Retry-After", 2 ** attempt))
-                    print(f"⏳ Rate limited. Waiting {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    if attempt == MAX_RETRIES - 1:
+                    # Waiting out a rate limit doesn't use up the error retry budget
+                    ratelimits += 1
+                    if ratelimits > MAX_RATELIMIT_WAITS:
                         raise
-                    print(f"⚠️  API error: {e.response['error']}. Retrying...")
-                    time.sleep(2 ** attempt)
-        raise Exception("Max retries exceeded")
+                    wait_time = float(e.response.headers.get("Retry-After", 1))
+                    per_minute = self.scheduler.ratelimited(method, wait_time)
+                    print(f"⏳ Rate limited on {method}. Pausing it for {wait_time:g}s, "
+                          f"then pacing at {per_minute:.0f} calls/min...")
+                    logger.warning(f"Rate limited on {method}, backing off {wait_time:g}s, "
+                                   f"paced at {per_minute:.1f}/min")
+                    self.metrics.record_ratelimit(method, wait_time)
+                    continue
+                ratelimits = 0  # Only ratelimited responses in a row count towards MAX_RATELIMIT_WAITS
+                attempt += 1
+                if attempt >= max_retries:
+                    raise
+                print(f"⚠️  API error: {e.response['error']}. Retrying...")
+                self.metrics.record_retry(method)
+                time.sleep(2 ** (attempt - 1))
 
     def load_users(self):
-        """Load all users from the workspace."""
+        """Load user names, either the whole workspace up front or on demand.
+        
+        Names are only needed for the anonymization key, so unless
+        ``user_resolution`` is "preload" (or the user list is cached, or
+        exclude_users lists user names) they are looked up with users.info
+        for the users the export actually meets. "auto" first reads one
+        users.list page and keeps it if that is the whole workspace.
+        """
         print("\n🔗 Connecting to Slack workspace...")
         logger.info("Starting user list retrieval")
+        users = self.cache.get("users.list", {}) if self.cache else None
+        if users is not None:
+            logger.info("Using cached user list")
+        elif (self.settings.user_resolution != "preload"
+              and all(USER_ID_RE.fullmatch(u) for u in self.settings.exclude_users)):
+            if self.settings.user_resolution == "auto":
+                resp = self.retry_api_call(self.client.users_list, limit=USERS_PAGE_SIZE)
+                if resp.get("response_metadata", {}).get("next_cursor"):
+                    self.id_to_name = {u["id"]: self._display_name(u) for u in resp["members"]}
+                else:
+                    users = resp["members"]
+                    self._cache_users(users)
+            if users is None:
+                self.user_resolver = UserResolver(self._lookup_user, self.settings.thread_workers,
+                                                  self.settings.user_preload_threshold)
+                print("👥 User names will be looked up as users appear in the export")
+                logger.info("Resolving user names on demand with users.info")
+                return
+        if users is None:
+            users = self._list_users()
+        self._set_users(users)
+    
+    def _list_users(self) -> List[Dict]:
+        """Page through users.list for every member of the workspace."""
         users, cursor = [], None
         while True:
             resp = self.retry_api_call(self.client.users_list, cursor=cursor)
@@ -170,150 +1973,280 @@ class SlackExporter:
             cursor = resp.get("response_metadata", {}).get("next_cursor")
             if not cursor:
                 break
-        
-        self.id_to_name = {
-            u["id"]: u.get("profile", {}).get("display_name") or u.get("name") 
-            for u in users
-        }
+        self._cache_users(users)
+        return users
+    
+    def _cache_users(self, users: List[Dict]):
+        if self.cache:
+            # Only what the export uses, full profiles would bloat the cache
+            self.cache.put("users.list", {}, [
+                {"id": u["id"], "name": u.get("name"),
+                 "profile": {"display_name": u.get("profile", {}).get("display_name")}}
+                for u in users
+            ])
+    
+    @staticmethod
+    def _display_name(user: Dict) -> Optional[str]:
+        return user.get("profile", {}).get("display_name") or user.get("name")
+    
+    def _set_users(self, users: List[Dict]):
+        self.id_to_name = {u["id"]: self._display_name(u) for u in users}
+        if self.settings.exclude_users:
+            # exclude_users may list user names as well as IDs
+            self.excluded_users |= {
+                u["id"] for u in users
+                if {u.get("name"), self.id_to_name[u["id"]]} & self.settings.exclude_users
+            }
+            logger.info(f"Excluding messages from {len(self.excluded_users)} user(s)")
+        if self.archive:
+            self.archive.save_users(self.id_to_name)
         print(f"👥 Loaded {len(self.id_to_name)} user profiles")
         logger.info(f"Successfully loaded {len(self.id_to_name)} user profiles")
+    
+    def _lookup_user(self, uid: str) -> Optional[str]:
+        """Display name of one user from users.info (or the API cache)."""
+        user = self.cache.get("users.info", {"user": uid}) if self.cache else None
+        if user is None:
+            user = self.retry_api_call(self.client.users_info, user=uid)["user"]
+            user = {"id": user["id"], "name": user.get("name"),
+                    "profile": {"display_name": user.get("profile", {}).get("display_name")}}
+            if self.cache:
+                self.cache.put("users.info", {"user": uid}, user)
+        return self._display_name(user)
+    
+    def resolve_user_names(self):
+        """Make sure id_to_name covers every anonymized user (on-demand mode only)."""
+        if self.user_resolver is None:
+            return
+        missing = [uid for uid in self.anon_map if uid not in self.id_to_name]
+        found = self.user_resolver.resolve(missing)
+        if self.user_resolver.overflowed:
+            print(f"👥 More than {self.settings.user_preload_threshold} users to look up, "
+                  f"loading the full user list instead")
+            self.user_resolver.shutdown()
+            self.user_resolver = None
+            self._set_users(self._list_users())
+            return
+        self.id_to_name.update(found)
+        if self.archive:
+            self.archive.save_users(found)
+        logger.info(f"Looked up {len(found)} of {len(missing)} user name(s) on demand")
 
     def get_channels(self) -> List[Dict]:
-        """Retrieve all accessible channels, sorted alphabetically."""
-        channels, cursor = [], None
-        while True:
-            resp = self.retry_api_call(
-                self.client.conversations_list, 
-                types="public_channel,private_channel", 
-                cursor=cursor, 
-                limit=200
-            )
-            channels.extend(resp["channels"])
-            cursor = resp.get("response_metadata", {}).get("next_cursor")
-            if not cursor:
-                break
+        """Retrieve all accessible channels that pass the config filters, sorted alphabetically.
+        
+        When ``include_only_channels`` lists nothing but channel IDs, those are
+        looked up one by one instead of paging through the whole workspace.
+        """
+        include = self.settings.include_channels
+        if include and all(CHANNEL_ID_RE.fullmatch(p) for p in include):
+            channels = self._get_channels_by_id(include)
+        else:
+            channels = self._list_channels()
         
         if not channels:
             raise SystemExit("❌ No channels found or token missing proper read scopes.")
         
+        channels = self.filter_channels(channels)
+        if not channels:
+            raise SystemExit("❌ No channels left after applying the config filters.")
+        
         # Sort alphabetically by channel name
         channels.sort(key=lambda c: c['name'].lower())
         return channels
+    
+    def _list_channels(self) -> List[Dict]:
+        params = {"types": "public_channel,private_channel"}
+        channels = self.cache.get("conversations.list", params) if self.cache else None
+        if channels is not None:
+            logger.info("Using cached channel list")
+        else:
+            channels, cursor = [], None
+            while True:
+                resp = self.retry_api_call(
+                    self.client.conversations_list, 
+                    cursor=cursor, 
+                    limit=200,
+                    **params
+                )
+                channels.extend(resp["channels"])
+                cursor = resp.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    break
+            if self.cache and channels:
+                self.cache.put("conversations.list", params, channels)
+        return channels
 
+    def _get_channels_by_id(self, channel_ids: List[str]) -> List[Dict]:
+        channels = []
+        for channel_id in channel_ids:
+            try:
+                channels.append(self.retry_api_call(self.client.conversations_info, channel=channel_id)["channel"])
+            except SlackApiError as e:
+                print(f"⚠️  Skipping channel {channel_id}: {e.response['error']}")
+                logger.warning(f"Could not look up channel {channel_id}: {e.response['error']}")
+        logger.info(f"Looked up {len(channels)} channel(s) by ID")
+        return channels
+    
+    def filter_channels(self, channels: List[Dict]) -> List[Dict]:
+        """Apply the include_only_channels and exclude_channels filters."""
+        include, exclude = self.settings.include_channels, self.settings.exclude_channels
+        if not (include or exclude):
+            return channels
+        kept = [
+            c for c in channels
+            if (not include or channel_matches(c, include)) and not channel_matches(c, exclude)
+        ]
+        print(f"🔎 Channel filters: {len(kept)} of {len(channels)} channels kept")
+        logger.info(f"Channel filters kept {len(kept)} of {len(channels)} channels")
+        return kept
+    
+    def project_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Trim freshly fetched messages to the configured fields, interning user IDs.
+        
+        Files keep what downloads and the outputs use, reactions their name
+        and count. With the "full" projection only the user IDs are interned.
+        """
+        projected = []
+        for msg in messages:
+            if "user" in msg:
+                msg["user"] = sys.intern(msg["user"])
+            if self.projection is None:
+                projected.append(msg)
+                continue
+            kept = {k: v for k, v in msg.items() if k in self.projection}
+            if kept.get("files"):
+                kept["files"] = [{k: v for k, v in f.items() if k in PROJECTION_FILE_FIELDS}
+                                 for f in kept["files"]]
+            if kept.get("reactions"):
+                kept["reactions"] = [{"name": r["name"], "count": r["count"]} for r in kept["reactions"]]
+            projected.append(kept)
+        return projected
+    
+    def drop_excluded_users(self, messages: List[Dict]) -> List[Dict]:
+        """Messages not written by anyone in exclude_users."""
+        if not self.excluded_users:
+            return messages
+        return [m for m in messages if m.get("user") not in self.excluded_users]
+
+    def save_anonymization_key(self, timestamp_str: Optional[str]) -> str:
+        """Write the anon ID -> username key next to the exports, returns its path.
+        
+        Without a timestamp (incremental runs) the archive's single
+        ANON_KEY_FILENAME is replaced, since the map only ever grows.
+        """
+        self.resolve_user_names()
+        name = f"{timestamp_str}-{ANON_KEY_FILENAME}" if timestamp_str else ANON_KEY_FILENAME
+        key_file = os.path.join(self.export_folder, name)
+        anon_key = {anon: self.id_to_name.get(uid, uid) for uid, anon in self.anon_map.items()}
+        with open(key_file + ".tmp", "w", encoding="utf-8") as kf:
+            json.dump(anon_key, kf, indent=2)
+        os.replace(key_file + ".tmp", key_file)
+        return key_file
+
+    def restore_anon_map(self, anon_map: Dict[str, str]):
+        """Continue numbering from a previously saved anonymization map."""
+        with self.anon_lock:
+            self.anon_map.update(anon_map)
+            numbers = [int(a[4:]) for a in self.anon_map.values() if a[4:].isdigit()]
+            self.anon_counter = max(numbers, default=0) + 1
+    
     def anon_id(self, uid: str) -> str:
-        """Convert user ID to anonymous identifier."""
-        if uid not in self.anon_map:
-            self.anon_map[uid] = f"anon{self.anon_counter:02d}"
-            self.anon_counter += 1
-        return self.anon_map[uid]
+        """Convert user ID to anonymous identifier.
+        
+        Sequential IDs (anon01, anon02, ...) depend on the order users are
+        met; in keyed mode the ID is an HMAC of the user ID instead. Users
+        already in a restored map keep their earlier ID either way.
+        """
+        with self.anon_lock:
+            anon = self.anon_map.get(uid)
+            if anon is not None:
+                return anon
+            if self.pseudonym_key is not None:
+                anon = keyed_pseudonym(self.pseudonym_key, uid)
+            else:
+                anon = f"anon{self.anon_counter:02d}"
+                self.anon_counter += 1
+            self.anon_map[uid] = anon
+        if self.user_resolver is not None and uid not in self.id_to_name:
+            # Look the name up in the background, the key written at the end needs it
+            self.user_resolver.prefetch(uid)
+        return anon
     
     def is_private_or_special_ip(self, ip: str) -> bool:
         """Check if IP is private/internal or special use (should NOT be anonymized)."""
-        try:
-            parts = [int(p) for p in ip.split('.')]
-            if len(parts) != 4:
-                return False
-            
-            # Check for private ranges (RFC 1918)
-            if parts[0] == 10:  # 10.0.0.0/8
-                return True
-            if parts[0] == 172 and 16 <= parts[1] <= 31:  # 172.16.0.0/12
-                return True
-            if parts[0] == 192 and parts[1] == 168:  # 192.168.0.0/16
-                return True
-            
-            # Localhost
-            if parts[0] == 127:  # 127.0.0.0/8
-                return True
-            
-            # Link-local
-            if parts[0] == 169 and parts[1] == 254:  # 169.254.0.0/16
-                return True
-            
-            # Unspecified
-            if ip == "0.0.0.0":
-                return True
-            
-            # Common public DNS servers (not sensitive)
-            public_dns = [
-                "8.8.8.8", "8.8.4.4",  # Google
-                "1.1.1.1", "1.0.0.1",  # Cloudflare
-                "9.9.9.9",              # Quad9
-                "208.67.222.222", "208.67.220.220"  # OpenDNS
-            ]
-            if ip in public_dns:
-                return True
-            
-            return False
-        except (ValueError, IndexError):
-            return False
+        return is_allowlisted_ip(ip)
     
     def anonymize_ip_addresses(self, text: str) -> str:
         """Replace public IP addresses with [IP-REDACTED], keep private/internal IPs."""
-        if not ANONYMIZE_IPS:
+        if not self.settings.anonymize_ips:
             return text
-        
-        # Regex to match IPv4 addresses
-        ip_pattern = r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b'
-        
-        def replace_ip(match):
-            ip = match.group(0)
-            if self.is_private_or_special_ip(ip):
-                return ip  # Keep private/internal IPs unchanged
-            else:
-                return "[IP-REDACTED]"  # Anonymize public IPs
-        
-        return re.sub(ip_pattern, replace_ip, text)
+        return IPV4_RE.sub(redact_ip, text)
 
     def clean_text(self, text: str, format_type: str = "text") -> str:
         """Sanitize message text by removing/replacing sensitive content."""
-        # Replace user mentions with anonymous IDs
-        if format_type == "markdown":
-            text = re.sub(r"<@(U[0-9A-Z]+)>", lambda m: f"**@{self.anon_id(m.group(1))}**", text)
-        else:
-            text = re.sub(r"<@(U[0-9A-Z]+)>", lambda m: f"[@{self.anon_id(m.group(1))}]", text)
-        
-        # Remove custom emoji markers (keep text between colons)
-        text = re.sub(r":(\w+):", r"\1", text)
-        # Clean up URLs
-        text = re.sub(r"<(http[^>|]+)(\|[^>]+)?>", r"\1", text)
-        # Remove channel mentions
-        text = re.sub(r"<#[^>]+>", "[channel]", text)
-        
-        # Anonymize public IP addresses if enabled
-        text = self.anonymize_ip_addresses(text)
+        plain, markdown = self.clean_cached(text)
+        return markdown if format_type == "markdown" else plain
+
+    def _sanitize(self, text: str) -> tuple:
+        """Rewrite mentions, emoji, links, channel refs and IPs in one scan.
         
-        return text.strip()
+        Returns the cleaned text for both dialects; they only differ in how
+        user mentions are rendered.
+        """
+        pattern = SANITIZE_IP_RE if self.settings.anonymize_ips else SANITIZE_RE
+        plain, markdown = [], []
+        pos = 0
+        for m in pattern.finditer(text):
+            if m.start() > pos:
+                plain.append(text[pos:m.start()])
+                markdown.append(text[pos:m.start()])
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "user":
+                anon = self.anon_id(m.group("user"))
+                plain.append(f"[@{anon}]")
+                markdown.append(f"**@{anon}**")
+                continue
+            if kind == "url":
+                token = self.anonymize_ip_addresses(m.group("url"))
+            elif kind == "channel":
+                token = "[channel]"
+            elif kind == "emoji":
+                token = m.group("emoji")
+            else:
+                token = redact_ip(m)
+            plain.append(token)
+            markdown.append(token)
+        if not pos:
+            text = text.strip()
+            return text, text
+        plain.append(text[pos:])
+        markdown.append(text[pos:])
+        return "".join(plain).strip(), "".join(markdown).strip()
 
     def download_file(self, file_info: Dict, channel_name: str, msg_ts: str) -> Optional[str]:
         """Download a file attachment to local storage."""
-        if not DOWNLOAD_FILES:
-            return None
+        return self.fetch_attachment(file_info, channel_name, msg_ts)[0]
+    
+    def fetch_attachment(self, file_info: Dict, channel_name: str, msg_ts: str) -> tuple:
+        """Like download_file, returns (local path, whether it came from the blob store)."""
+        if not self.settings.download_files:
+            return None, False
         
         if not HAS_REQUESTS:
             logger.warning("Cannot download files without 'requests' library installed")
-            return None
+            return None, False
         
+        # Without a file ID there is no index entry to race for, so no lock is needed
+        if self.blob_store and file_info.get("id"):
+            with self.blob_store.file_lock(file_info["id"]):
+                return self._download_file(file_info, channel_name, msg_ts)
+        return self._download_file(file_info, channel_name, msg_ts)
+    
+    def _download_file(self, file_info: Dict, channel_name: str, msg_ts: str) -> tuple:
+        local_path = None
         try:
-            # Try to get a fresh download URL using files.info API
-            file_id = file_info.get("id")
-            if file_id:
-                try:
-                    file_details = self.client.files_info(file=file_id)
-                    # Get the fresh URL from the API response
-                    url = file_details.get("file", {}).get("url_private_download") or \
-                          file_details.get("file", {}).get("url_private")
-                    logger.debug(f"Got fresh URL for {file_info.get('name')} via API")
-                except Exception as e:
-                    logger.debug(f"Could not get fresh URL via API: {e}, using URL from message")
-                    url = file_info.get("url_private_download") or file_info.get("url_private")
-            else:
-                url = file_info.get("url_private_download") or file_info.get("url_private")
-            
-            if not url:
-                logger.warning(f"No download URL found for file: {file_info.get('name', 'unknown')}")
-                return None
-            
             # Create attachments directory
             attach_dir = os.path.join(self.export_folder, "attachments", channel_name)
             os.makedirs(attach_dir, exist_ok=True)
@@ -334,61 +2267,58 @@ class SlackExporter:
             
             # Get expected file size from metadata
             expected_size = file_info.get("size", 0)
+            file_id = file_info.get("id")
             
-            # Download with authentication - allow redirects and add additional headers
-            headers = {
-                "Authorization": f"Bearer {self.client.token}",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
+            # Already in the blob store from an earlier run or another channel - no download needed
+            if self.blob_store:
+                blob_path = self.blob_store.lookup(file_id, expected_size)
+                if blob_path:
+                    saved_path = self._place_blob(blob_path, local_path, channel_name, msg_ts, file_info)
+                    logger.info(f"Reused from blob store: {original_name}")
+                    return self._export_relpath(saved_path), True
             
-            logger.debug(f"Downloading {original_name} (expected: {expected_size:,} bytes)")
+            # URLs from the message are usually still valid, files.info is only asked when they fail
+            urls = [u for u in (file_info.get("url_private_download"), file_info.get("url_private")) if u]
+            refreshed = self.settings.url_refresh == "always" or not urls
+            if refreshed:
+                fresh = self.url_refresher.refresh(file_id)
+                urls = fresh + [u for u in urls if u not in fresh]
             
-            # Download with redirect following
-            response = requests.get(
-                url, 
-                headers=headers, 
-                allow_redirects=True,
-                timeout=60
-            )
-            response.raise_for_status()
+            if not urls:
+                logger.warning(f"No download URL found for file: {file_info.get('name', 'unknown')}")
+                return None, False
             
-            # Check content type - make sure we got the actual file, not an error page
-            content_type = response.headers.get('content-type', '').lower()
+            logger.debug(f"Downloading {original_name} (expected: {expected_size:,} bytes)")
             
-            # Log what we got
-            logger.debug(f"Response content-type: {content_type}")
-            logger.debug(f"Response size: {len(response.content):,} bytes")
+            # Stream to a temp file and rename it into place once complete
+            part_path = local_path + ".part"
+            digest = self._fetch_first(urls, part_path, original_name)
             
-            # Check if we got HTML instead of the file
-            if 'text/html' in content_type or 'application/xhtml' in content_type:
-                logger.error(f"Got HTML instead of file for {original_name}")
-                logger.debug(f"Response preview: {response.text[:200]}")
-                
-                # Try alternate URL if available
-                alt_url = file_info.get("url_private") if "url_private_download" in url else file_info.get("url_private_download")
-                if alt_url and alt_url != url:
-                    logger.info(f"Trying alternate URL for {original_name}")
-                    response = requests.get(alt_url, headers=headers, allow_redirects=True, timeout=60)
-                    response.raise_for_status()
-                    content_type = response.headers.get('content-type', '').lower()
-                    
-                    if 'text/html' in content_type:
-                        logger.error(f"Alternate URL also returned HTML for {original_name}")
-                        return None
-                else:
-                    return None
+            if not digest and not refreshed:
+                fresh = [u for u in self.url_refresher.refresh(file_id) if u not in urls]
+                if fresh:
+                    logger.info(f"Retrying {original_name} with a refreshed URL")
+                    digest = self._fetch_first(fresh, part_path, original_name)
             
-            # Save file
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
+            if not digest:
+                logger.error(f"Could not download {original_name}: every URL was rejected or returned HTML")
+                self._discard_partial(local_path)
+                return None, False
             
             # Verify file was written correctly
-            actual_size = os.path.getsize(local_path)
+            actual_size = os.path.getsize(part_path)
             
             if actual_size == 0:
                 logger.error(f"Downloaded file is empty: {original_name}")
-                os.remove(local_path)
-                return None
+                os.remove(part_path)
+                return None, False
+            
+            if self.blob_store:
+                blob_path = self.blob_store.add(file_id, part_path, digest)
+                saved_path = self._place_blob(blob_path, local_path, channel_name, msg_ts, file_info)
+            else:
+                os.replace(part_path, local_path)
+                saved_path = local_path
             
             # Verify size matches expected
             if expected_size > 0:
@@ -402,136 +2332,445 @@ class SlackExporter:
             else:
                 logger.info(f"Downloaded: {original_name} ({actual_size:,} bytes)")
             
-            return os.path.relpath(local_path, self.export_folder)
+            return self._export_relpath(saved_path), False
             
         except requests.exceptions.HTTPError as e:
+            self._discard_partial(local_path)
             logger.error(f"HTTP {e.response.status_code} downloading {file_info.get('name', 'unknown')}")
             if e.response.status_code == 403:
                 logger.error("403 Forbidden - Token may be missing 'files:read' scope")
-            return None
+            return None, False
         except requests.exceptions.RequestException as e:
+            self._discard_partial(local_path)
             logger.warning(f"Network error downloading {file_info.get('name', 'unknown')}: {str(e)}")
-            return None
+            return None, False
         except Exception as e:
+            self._discard_partial(local_path)
             logger.error(f"Unexpected error downloading {file_info.get('name', 'unknown')}: {str(e)}", exc_info=True)
-            return None
+            return None, False
+
+    def _place_blob(self, blob_path: str, local_path: str, channel_name: str, msg_ts: str, file_info: Dict) -> str:
+        """Link a stored blob into this export, recording it in the manifest when not linked."""
+        saved_path = BlobStore.place(blob_path, local_path, self.settings.link_mode)
+        if self.settings.link_mode == "manifest":
+            manifest_path = os.path.join(self.export_folder, "attachments", "manifest.ndjson")
+            entry = {
+                "channel": channel_name,
+                "ts": msg_ts,
+                "file_id": file_info.get("id"),
+                "name": file_info.get("name"),
+                "blob": self._export_relpath(blob_path),
+            }
+            with self.blob_store.lock:
+                with open(manifest_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return saved_path
 
-    def fetch_thread_replies(self, channel_id: str, thread_ts: str) -> List[Dict]:
-        """Fetch all replies in a thread."""
+    def _export_relpath(self, path: str) -> str:
+        """Path relative to the export folder (absolute if it lives on another drive)."""
         try:
-            resp = self.retry_api_call(
-                self.client.conversations_replies,
-                channel=channel_id,
-                ts=thread_ts,
-                limit=100
-            )
-            # Skip the parent message (first item)
-            return resp["messages"][1:] if len(resp["messages"]) > 1 else []
-        except SlackApiError:
-            return []
+            return os.path.relpath(path, self.export_folder)
+        except ValueError:
+            return path
 
-    def fetch_messages(self, channel_id: str, cutoff_ts: Optional[float]) -> List[Dict]:
-        """Fetch all messages from a channel with optional date filter."""
-        messages, cursor = [], None
-        while True:
-            resp = self.retry_api_call(
-                self.client.conversations_history,
-                channel=channel_id,
-                cursor=cursor,
-                limit=200
-            )
-            batch = resp["messages"]
-            
-            # Apply date filter if specified
-            if cutoff_ts:
-                batch = [m for m in batch if float(m["ts"]) >= cutoff_ts]
+    def _fetch_first(self, urls: List[str], part_path: str, name: str) -> Optional[str]:
+        """Try each URL in turn, returns the SHA-256 of the first real file.
+        
+        A 403/404 or an HTML page means the URL is stale and the next one is tried;
+        other HTTP and network errors are raised.
+        """
+        for url in urls:
+            try:
+                with self.downloads.host_slot(url):
+                    digest = self._stream_to_file(url, part_path, name)
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code not in STALE_URL_STATUSES:
+                    raise
+                logger.info(f"HTTP {e.response.status_code} for {name}, URL may have expired")
+                if e.response.status_code == 403:
+                    logger.debug("403 Forbidden - URL expired or token missing 'files:read' scope")
+                continue
+            if digest:
+                return digest
+        return None
+
+    def _stream_to_file(self, url: str, part_path: str, name: str) -> Optional[str]:
+        """Stream a download to `part_path` in chunks.
+        
+        Returns the SHA-256 of the content, or None if Slack sent an HTML error page.
+        """
+        digest = hashlib.sha256()
+        with self.http.get(url, allow_redirects=True, timeout=60, stream=True) as response:
+            response.raise_for_status()
             
-            # Fetch threaded replies if enabled
-            if FETCH_THREADS:
-                for msg in batch:
-                    if msg.get("reply_count", 0) > 0:
-                        replies = self.fetch_thread_replies(channel_id, msg["ts"])
-                        msg["thread_messages"] = replies
+            # Check content type - make sure we got the actual file, not an error page
+            content_type = response.headers.get('content-type', '').lower()
+            logger.debug(f"Response content-type: {content_type}")
+            if 'text/html' in content_type or 'application/xhtml' in content_type:
+                logger.error(f"Got HTML instead of file for {name}")
+                return None
             
-            messages.extend(batch)
-            cursor = resp.get("response_metadata", {}).get("next_cursor")
-            if not cursor:
-                break
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    self.metrics.record_download(len(chunk))
+        logger.debug(f"Response size: {os.path.getsize(part_path):,} bytes")
+        return digest.hexdigest()
+
+    @staticmethod
+    def _discard_partial(local_path: Optional[str]):
+        """Remove a half-written .part file after a failed download."""
+        if local_path and os.path.exists(local_path + ".part"):
+            os.remove(local_path + ".part")
+
+    def fetch_thread_replies(self, channel_id: str, thread_ts: str,
+                             latest_reply: Optional[str] = None) -> List[Dict]:
+        """Fetch all replies in a thread, following pagination to the end.
+        
+        With the API cache on, a thread whose ``latest_reply`` hasn't moved
+        since it was cached is served locally.
+        """
+        params = {"channel": channel_id, "ts": thread_ts}
+        if self.cache and latest_reply:
+            cached = self.cache.get("conversations.replies", params, latest_reply)
+            if cached is not None:
+                return self.project_messages(self.drop_excluded_users(cached))
+        
+        replies, cursor = [], None
+        try:
+            while True:
+                resp = self.retry_api_call(
+                    self.client.conversations_replies,
+                    channel=channel_id,
+                    ts=thread_ts,
+                    cursor=cursor,
+                    limit=200
+                )
+                # Every page repeats the parent message, skip it
+                replies.extend(m for m in resp["messages"] if m.get("ts") != thread_ts)
+                cursor = resp.get("response_metadata", {}).get("next_cursor")
+                if not cursor or not resp.get("has_more", True):
+                    break
+            if self.cache and latest_reply:
+                self.cache.put("conversations.replies", params, replies, latest_reply)
+        except SlackApiError as e:
+            logger.warning(f"Could not fetch replies for thread {thread_ts} in {channel_id}: {e.response['error']}")
+        # The cache keeps full replies, so a later run with another projection can still use them
+        return self.project_messages(self.drop_excluded_users(replies))
+
+    def fetch_messages(self, channel_id: str, cutoff_ts: Optional[float],
+                       latest_ts: Optional[float] = None,
+                       known_threads: Optional[Dict[str, str]] = None,
+                       channel_name: Optional[str] = None, stream: bool = False,
+                       download_files: bool = False) -> List[Dict]:
+        """Fetch all messages from a channel within an optional date window.
+
+        The window is passed to conversations.history as ``oldest``/``latest`` so
+        Slack only returns pages inside it, and pagination stops as soon as the
+        window is exhausted. Thread replies are only fetched for messages that
+        fall inside the window.
+        
+        Thread parents are queued on the shared reply pool as each history page
+        arrives, so reply fetching overlaps with pagination instead of blocking
+        it. Parents are matched back to their replies once paging is done.
+        
+        ``known_threads`` maps parent ts to the ``latest_reply`` already archived;
+        those threads are only fetched again when Slack reports a newer reply.
+        
+        When a checkpoint is attached, each page is committed to it in order once
+        its thread replies are in, and a resumed run continues from the saved cursor.
+        
+        With ``download_files`` the attachments of each page are queued on the
+        download pool (into ``channel_name``) as soon as the page arrives, and
+        the page is committed once they are saved.
         
+        With ``stream`` the pages only live in the checkpoint spool and a
+        MessageSpool is returned instead of a list.
+        """
+        params = {"channel": channel_id, "limit": 200}
+        if cutoff_ts:
+            params["oldest"] = f"{cutoff_ts:.6f}"
+        if latest_ts:
+            params["latest"] = f"{latest_ts:.6f}"
+            params["inclusive"] = True
+        
+        if stream and not self.checkpoint:
+            raise ValueError("Streaming output needs a checkpoint to spool pages to")
+        
+        messages, cursor = [], None
+        if stream:
+            messages = self.checkpoint.open_spool(channel_id)
+        if self.checkpoint:
+            progress = self.checkpoint.channel_progress(channel_id)
+            if progress:
+                if not stream:
+                    messages = self.checkpoint.load_messages(channel_id)
+                logger.info(f"Resuming {channel_id} with {len(messages)} checkpointed messages")
+                if progress.get("done"):
+                    return messages
+                cursor = progress.get("cursor")
+                print(f"   ↻ Resuming after {len(messages)} checkpointed messages")
+        
+        # Pages wait here, in order, until their thread replies and attachments have arrived
+        pending_pages = deque()
+        
+        def commit_pages(final: bool = False):
+            while pending_pages:
+                batch, threads, downloads, next_cursor, done = pending_pages[0]
+                ready = all(future.done() for _, future in threads) and all(f.done() for f in downloads)
+                if not (ready or final or len(pending_pages) > MAX_PENDING_PAGES):
+                    break
+                # Match thread parents back to their replies
+                for msg, future in threads:
+                    msg["thread_messages"] = future.result()
+                for future in downloads:
+                    future.result()
+                pending_pages.popleft()
+                messages.extend(batch)
+                if self.checkpoint:
+                    self.checkpoint.commit_page(channel_id, batch, next_cursor, done)
+        
+        try:
+            while True:
+                resp = self.retry_api_call(
+                    self.client.conversations_history,
+                    cursor=cursor,
+                    **params
+                )
+                batch = resp["messages"]
+                
+                # Guard against anything outside the window (history is newest first)
+                window_exhausted = False
+                if cutoff_ts:
+                    in_window = [m for m in batch if float(m["ts"]) >= cutoff_ts]
+                    window_exhausted = len(in_window) < len(batch)
+                    batch = in_window
+                if latest_ts:
+                    batch = [m for m in batch if float(m["ts"]) <= latest_ts]
+                # Excluded users' messages never reach the thread or download stages
+                batch = self.project_messages(self.drop_excluded_users(batch))
+                
+                # Queue threaded replies if enabled
+                threads = []
+                if self.settings.fetch_threads:
+                    for msg in batch:
+                        if msg.get("reply_count", 0) > 0:
+                            if known_threads and known_threads.get(msg["ts"]) == msg.get("latest_reply"):
+                                continue
+                            future = self.reply_pool.submit(
+                                self.metrics.timed, channel_name or channel_id, "thread_replies",
+                                self.fetch_thread_replies, channel_id, msg["ts"], msg.get("latest_reply")
+                            )
+                            threads.append((msg, future))
+                
+                # Start attachment downloads while the next pages are fetched
+                downloads = self.queue_downloads(batch, channel_name or channel_id) if download_files else []
+                
+                cursor = resp.get("response_metadata", {}).get("next_cursor")
+                done = not cursor or not resp.get("has_more", True) or window_exhausted
+                pending_pages.append((batch, threads, downloads, cursor, done))
+                commit_pages()
+                if done:
+                    break
+        except BaseException:
+            # Keep the pages fetched so far so a resumed run doesn't fetch them again
+            if self.checkpoint:
+                try:
+                    commit_pages(final=True)
+                except Exception as e:
+                    logger.warning(f"Could not checkpoint pending pages for {channel_id}: {e}")
+            raise
+        
+        commit_pages(final=True)
         return messages
 
-    def format_message_text(self, msg: Dict, indent: int = 0, format_type: str = "text") -> str:
-        """Format a single message for text or markdown output."""
+    def prepare_message(self, msg: Dict) -> PreparedMessage:
+        """Resolve the author, timestamp and cleaned text of a message (and its replies) once for all writers."""
         uid = msg.get("user", "system")
         anon = self.anon_id(uid) if uid != "system" else "System"
-        text = self.clean_text(msg.get("text", ""), format_type)
+        text, markdown = self.clean_cached(msg.get("text", ""))
         ts = datetime.fromtimestamp(float(msg["ts"])).strftime("%Y-%m-%d %H:%M:%S")
-        
-        if format_type == "markdown":
-            prefix = "  " * indent
-            output = f"{prefix}**{anon}** [{ts}]: {text}\n"
-            
-            # Add reactions
-            if INCLUDE_REACTIONS and msg.get("reactions"):
-                reactions = " ".join([f":{r['name']}:" for r in msg["reactions"]])
-                output += f"{prefix}*Reactions: {reactions}*\n"
-            
-            # Add file info
-            if msg.get("files"):
-                for f in msg["files"]:
-                    fname = f.get('name', 'unnamed')
-                    ftype = f.get('mimetype', 'unknown')
-                    local_path = f.get('local_path')
-                    if local_path:
-                        output += f"{prefix}📎 [{fname}]({local_path}) ({ftype})\n"
-                    else:
-                        output += f"{prefix}📎 {fname} ({ftype})\n"
+        replies = [self.prepare_message(reply) for reply in msg.get("thread_messages") or []]
+        return PreparedMessage(msg, anon, ts, text, markdown, replies)
+
+    def format_message_text(self, msg: Dict, indent: int = 0, format_type: str = "text") -> str:
+        """Format a single message for text or markdown output."""
+        writer = MarkdownWriter if format_type == "markdown" else TextWriter
+        return writer.format(self.prepare_message(msg), indent, self.settings.include_reactions)
+
+    def queue_downloads(self, messages: List[Dict], cname: str) -> list:
+        """Queue downloads for files without a local copy yet, returns their futures."""
+        futures = []
+        for msg in messages:
+            for file_info in msg.get("files") or []:
+                if file_info.get("local_path"):
+                    continue
+                key = f"{cname}:{msg['ts']}:{file_info.get('id')}"
+                local_path = self.checkpoint.downloaded(key) if self.checkpoint else None
+                if local_path:
+                    file_info["local_path"] = local_path
+                    continue
+                futures.append(self.downloads.submit(
+                    self.metrics.timed, cname, "downloads", self._download_task, file_info, cname, msg["ts"], key
+                ))
+        return futures
+
+    def _download_task(self, file_info: Dict, cname: str, msg_ts: str, key: str) -> Optional[str]:
+        local_path, reused = self.fetch_attachment(file_info, cname, msg_ts)
+        if local_path:
+            file_info["local_path"] = local_path
+            if self.checkpoint:
+                self.checkpoint.record_download(key, local_path)
+            self.downloads.record(os.path.getsize(os.path.join(self.export_folder, local_path)), reused)
         else:
-            # Plain text format
-            prefix = "  " * indent
-            output = f"{prefix}{anon} [{ts}]: {text}"
-            
-            if INCLUDE_REACTIONS and msg.get("reactions"):
-                reactions = ", ".join([f":{r['name']}:{r['count']}" for r in msg["reactions"]])
-                output += f"\n{prefix}  Reactions: {reactions}"
-            
-            if msg.get("files"):
-                for f in msg["files"]:
-                    fname = f.get('name', 'unnamed')
-                    ftype = f.get('mimetype', 'unknown')
-                    local_path = f.get('local_path')
-                    if local_path:
-                        output += f"\n{prefix}  📎 File: {fname} ({ftype}) [Saved to: {local_path}]"
-                    else:
-                        output += f"\n{prefix}  📎 File: {fname} ({ftype})"
+            self.downloads.record(None)
+        return local_path
+
+    def download_attachments(self, messages: List[Dict], cname: str) -> int:
+        """Download files for messages that don't have a local copy yet."""
+        file_count = sum(1 for future in self.queue_downloads(messages, cname) if future.result())
+        if file_count > 0:
+            logger.info(f"Downloaded {file_count} files for #{cname}")
+        return file_count
+
+    def merge_archive(self, json_path: str, fetched: List[Dict], spool_path: str) -> tuple:
+        """Merge freshly fetched messages into a channel's archived JSON.
         
-        return output
+        Fetched copies replace archived ones (picking up edits), but keep the
+        archived thread replies and downloaded file paths when they weren't
+        fetched again this run. The archive is streamed one message at a time
+        into a spool at ``spool_path``, so it is never loaded whole.
+        
+        Returns the merged messages (newest first) and the fetched messages
+        newer than anything archived, oldest first. The second item is None
+        when an archived message changed or there is no archive yet, so the
+        TXT/Markdown files have to be rewritten rather than appended to.
+        """
+        by_ts = {m["ts"]: m for m in fetched}
+        newest = None
+        changed = False
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        archived = MessageSpool(spool_path)
+        existing = find_output(json_path, self.settings.compression)
+        with open(spool_path, "w", encoding="utf-8") as spool:
+            if existing:
+                with open_output(existing, "rt", compression_of(existing)) as jf:
+                    for old in iter_json_array(jf):
+                        newest = newest or old["ts"]
+                        msg = by_ts.pop(old["ts"], None)
+                        if msg is None:
+                            spool.write(json.dumps(old, ensure_ascii=False) + "\n")
+                            archived.extend([old])
+                            continue
+                        if "thread_messages" not in msg and old.get("thread_messages"):
+                            msg["thread_messages"] = old["thread_messages"]
+                        saved_paths = {f.get("id"): f.get("local_path") for f in old.get("files", []) if f.get("local_path")}
+                        for file_info in msg.get("files", []):
+                            if file_info.get("id") in saved_paths:
+                                file_info["local_path"] = saved_paths[file_info["id"]]
+                        changed = changed or msg != old
+        
+        # Fetched messages left over are new to the archive, at the end unless older than its newest
+        added = sorted(by_ts.values(), key=lambda m: float(m["ts"]))
+        if newest is None or changed or (added and float(added[0]["ts"]) <= float(newest)):
+            added = None
+        return MergedMessages(archived, fetched), added
+
+    def write_outputs(self, cname: str, messages: List[Dict], base_name: str,
+                      channel_id: Optional[str] = None, appended: Optional[List[Dict]] = None) -> tuple:
+        """Write the JSON, TXT and (optionally) Markdown files for a channel.
+        
+        Messages are walked once in chronological order, each prepared once
+        and handed to every rendering writer (and the search index, if
+        enabled, in batches). The JSON keeps API order, so it is written in
+        a separate pass over the raw messages. A MessageSpool is read
+        straight from disk and saved as ``.ndjson`` instead of a JSON array.
+        
+        With ``appended`` (chronological), existing TXT/Markdown files only
+        get those messages added at the end, and only they are indexed.
+        """
+        streamed = isinstance(messages, MessageSpool)
+        json_writer = CompactJsonWriter if self.settings.compact_json else JsonWriter
+        writer_types = [NdjsonWriter if streamed else json_writer, TextWriter]
+        if self.settings.create_markdown:
+            writer_types.append(MarkdownWriter)
+        if self.settings.columnar:
+            writer_types.append(ArrowWriter if self.settings.columnar == "arrow" else ColumnarWriter)
+        
+        writers = []
+        try:
+            for writer_type in writer_types:
+                # Parquet and Arrow compress internally
+                compression = "none" if issubclass(writer_type, ColumnarWriter) else self.settings.compression
+                path = os.path.join(self.export_folder,
+                                    base_name + writer_type.suffix + COMPRESSION_SUFFIXES[compression])
+                append = appended is not None and writer_type.appendable and os.path.exists(path)
+                writers.append(writer_type(path, cname, self.settings.include_reactions,
+                                           compression, self.settings.compression_level, append))
+            raw_writers = [w for w in writers if w.newest_first]
+            for msg in messages:
+                for writer in raw_writers:
+                    writer.write_raw(msg)
+            
+            full_writers = [w for w in writers if not w.newest_first and not w.appending]
+            passes = []
+            if full_writers or appended is None:
+                passes.append((reversed(messages), full_writers, appended is None))
+            if appended is not None:
+                passes.append((appended, [w for w in writers if w.appending], True))
+            indexing = self.search_index is not None and channel_id is not None
+            export = os.path.basename(os.path.normpath(self.export_folder))
+            for source, targets, index in passes:
+                batch = []
+                for msg in source:
+                    prepared = self.prepare_message(msg)
+                    for writer in targets:
+                        writer.write(prepared)
+                    if indexing and index:
+                        batch.append(prepared)
+                        if len(batch) >= SEARCH_INDEX_BATCH:
+                            self.search_index.add(channel_id, cname, export, batch)
+                            batch = []
+                if indexing and batch:
+                    self.search_index.add(channel_id, cname, export, batch)
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        
+        for writer in writers:
+            writer.close()
+            logger.info(f"Saved {writer.label}: {writer.name}")
+        
+        md_name = next((w.name for w in writers if isinstance(w, MarkdownWriter)), None)
+        return writers[0].name, writers[1].name, md_name
 
-    def export_channel(self, channel: Dict, cutoff_ts: Optional[float], timestamp_str: str) -> tuple:
+    def export_channel(self, channel: Dict, cutoff_ts: Optional[float], timestamp_str: str,
+                       latest_ts: Optional[float] = None) -> tuple:
         """Export a single channel's messages."""
         cname = channel["name"]
         print(f"📡 Exporting channel: #{cname}")
         logger.info(f"Starting export for channel: #{cname}")
         
-        messages = self.fetch_messages(channel["id"], cutoff_ts)
+        stream = self.settings.streaming_output and self.checkpoint is not None
+        download_files = self.settings.download_files
         
-        # Download files if enabled
-        if DOWNLOAD_FILES and messages:
-            print(f"   → Downloading attachments...")
+        # Download files if enabled, overlapping with history fetching
+        if download_files:
+            print("   → Downloading attachments as pages arrive...")
             logger.info(f"Downloading attachments for #{cname}")
-            file_count = 0
-            for msg in messages:
-                if msg.get("files"):
-                    for file_info in msg["files"]:
-                        local_path = self.download_file(file_info, cname, msg["ts"])
-                        if local_path:
-                            file_info["local_path"] = local_path
-                            file_count += 1
-            if file_count > 0:
-                logger.info(f"Downloaded {file_count} files for #{cname}")
+        with self.metrics.stage(cname, "history"):
+            messages = self.fetch_messages(channel["id"], cutoff_ts, latest_ts, channel_name=cname,
+                                           stream=stream, download_files=download_files)
         
         msg_count = len(messages)
-        thread_count = sum(1 for m in messages if m.get("thread_messages"))
+        self.metrics.record_messages(cname, msg_count)
+        if stream:
+            thread_count = messages.thread_count
+        else:
+            thread_count = sum(1 for m in messages if m.get("thread_messages"))
         
         # Skip if no messages
         if msg_count == 0:
@@ -542,140 +2781,558 @@ class SlackExporter:
         print(f"   → Retrieved {msg_count} messages ({thread_count} with threads)")
         logger.info(f"Retrieved {msg_count} messages ({thread_count} with threads) for #{cname}")
         
-        json_name = f"{timestamp_str}-Slack-Export-{cname}.json"
-        txt_name = f"{timestamp_str}-Slack-Export-{cname}.txt"
-        md_name = f"{timestamp_str}-Slack-Export-{cname}.md" if CREATE_MARKDOWN else None
-        
-        # Save JSON
-        json_path = os.path.join(self.export_folder, json_name)
-        with open(json_path, "w", encoding="utf-8") as jf:
-            json.dump(messages, jf, indent=2, ensure_ascii=False)
-        logger.info(f"Saved JSON: {json_name}")
-        
-        # Save text
-        txt_path = os.path.join(self.export_folder, txt_name)
-        with open(txt_path, "w", encoding="utf-8") as tf:
-            for msg in reversed(messages):
-                tf.write(self.format_message_text(msg, format_type="text") + "\n")
-                
-                # Write thread replies with indentation
-                if msg.get("thread_messages"):
-                    tf.write(f"  ↳ Thread ({len(msg['thread_messages'])} replies):\n")
-                    for reply in msg["thread_messages"]:
-                        tf.write(self.format_message_text(reply, indent=2, format_type="text") + "\n")
-                
-                tf.write("\n")
-        logger.info(f"Saved TXT: {txt_name}")
-        
-        # Save markdown if enabled
-        if CREATE_MARKDOWN:
-            md_path = os.path.join(self.export_folder, md_name)
-            with open(md_path, "w", encoding="utf-8") as mf:
-                mf.write(f"# Channel: #{cname}\n\n")
-                mf.write(f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                mf.write("---\n\n")
-                
-                for msg in reversed(messages):
-                    mf.write(self.format_message_text(msg, format_type="markdown"))
-                    
-                    if msg.get("thread_messages"):
-                        mf.write(f"  *↳ Thread ({len(msg['thread_messages'])} replies):*\n\n")
-                        for reply in msg["thread_messages"]:
-                            mf.write(self.format_message_text(reply, indent=2, format_type="markdown"))
-                    
-                    mf.write("\n")
-            logger.info(f"Saved MD: {md_name}")
+        with self.metrics.stage(cname, "render"):
+            json_name, txt_name, md_name = self.write_outputs(
+                cname, messages, f"{timestamp_str}-Slack-Export-{cname}", channel["id"]
+            )
+        if self.archive:
+            with self.metrics.stage(cname, "archive_db"):
+                self.archive.save_channel(channel, messages, self.export_folder)
         
         files_created = f"{json_name}, {txt_name}"
-        if CREATE_MARKDOWN:
+        if md_name:
             files_created += f", {md_name}"
         
         print(f"   ✅ Saved {files_created}")
         return (cname, msg_count, json_name, txt_name, md_name)
 
+    def export_channel_incremental(self, channel: Dict, cutoff_ts: Optional[float],
+                                   latest_ts: Optional[float], state: ExportState) -> tuple:
+        """Fetch only what changed since the last run and merge it into the rolling archive.
+        
+        New messages are those after the channel's saved high-water mark. History
+        is also re-read for the last ``thread_active_days`` (but not before the
+        first run's window) so that threads whose ``latest_reply`` moved get
+        their replies refetched; replies to threads started before that are
+        not picked up.
+        """
+        cname = channel["name"]
+        channel_state = state.channel(channel["id"])
+        since_ts = channel_state.get("latest_ts")
+        known_threads = channel_state.get("threads", {})
+        oldest_ts = channel_state.get("oldest_ts")
+        active_since = time.time() - self.settings.thread_active_days * 86400
+        
+        if since_ts:
+            print(f"📡 Updating channel: #{cname} (new since {datetime.fromtimestamp(float(since_ts)).strftime('%Y-%m-%d %H:%M')})")
+            scan_from = min(float(since_ts), active_since)
+            if oldest_ts is not None:
+                # Never reach back past the window of the first run
+                scan_from = max(scan_from, oldest_ts)
+        else:
+            print(f"📡 Exporting channel: #{cname} (first incremental run)")
+            scan_from = oldest_ts = cutoff_ts
+        logger.info(f"Starting incremental export for channel: #{cname} (since {since_ts})")
+        
+        with self.metrics.stage(cname, "history"):
+            fetched = self.fetch_messages(channel["id"], scan_from, latest_ts, known_threads, channel_name=cname)
+        new_messages = [m for m in fetched if not since_ts or float(m["ts"]) > float(since_ts)]
+        updated_threads = [
+            m for m in fetched
+            if since_ts and float(m["ts"]) <= float(since_ts) and "thread_messages" in m
+        ]
+        
+        if not new_messages and not updated_threads:
+            print("   ⚠️  Nothing new since last run - archive unchanged")
+            logger.info(f"No new messages or replies for #{cname}")
+            return (cname, 0, None, None, None)
+        
+        base_name = f"Slack-Archive-{cname}"
+        spool_path = os.path.join(self.export_folder, f".merge-{channel['id']}.ndjson")
+        try:
+            with self.metrics.stage(cname, "merge"):
+                messages, appended = self.merge_archive(
+                    os.path.join(self.export_folder, f"{base_name}.json"), fetched, spool_path
+                )
+            self.metrics.record_messages(cname, len(new_messages))
+            
+            if self.settings.download_files:
+                new_ts = {m["ts"] for m in appended or []}
+                if appended is not None and any(
+                    not f.get("local_path") for m in fetched if m["ts"] not in new_ts for f in m.get("files") or []
+                ):
+                    # Archived messages will show newly downloaded files, so render them again
+                    appended = None
+                print("   → Downloading attachments...")
+                logger.info(f"Downloading attachments for #{cname}")
+                self.download_attachments(fetched, cname)
+            
+            print(f"   → {len(new_messages)} new messages, {len(updated_threads)} threads with new replies "
+                  f"({len(messages)} messages in archive)")
+            logger.info(f"#{cname}: {len(new_messages)} new messages, {len(updated_threads)} updated threads, "
+                        f"{len(messages)} archived, {'appended' if appended is not None else 'rewritten'}")
+            
+            with self.metrics.stage(cname, "render"):
+                json_name, txt_name, md_name = self.write_outputs(cname, messages, base_name, channel["id"], appended)
+            
+            latest = None
+            threads = {}
+            for m in messages:
+                latest = latest or m["ts"]
+                if float(m["ts"]) < active_since:
+                    break
+                if m.get("reply_count", 0) > 0:
+                    threads[m["ts"]] = m.get("latest_reply") or (
+                        m["thread_messages"][-1]["ts"] if m.get("thread_messages") else None
+                    )
+        finally:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+        # After a compression change, the archive written with the old one is superseded
+        current = COMPRESSION_SUFFIXES[self.settings.compression]
+        for suffix in (".json", ".txt", ".md"):
+            for other in COMPRESSION_SUFFIXES.values():
+                stale = os.path.join(self.export_folder, base_name + suffix + other)
+                if other != current and os.path.exists(stale):
+                    os.remove(stale)
+        # Likewise a table in a columnar format no longer written would go stale
+        for writer_type in (ColumnarWriter, ArrowWriter):
+            stale = os.path.join(self.export_folder, base_name + writer_type.suffix)
+            if self.settings.columnar != writer_type.suffix[1:] and os.path.exists(stale):
+                os.remove(stale)
+        if self.archive:
+            with self.metrics.stage(cname, "archive_db"):
+                self.archive.save_channel(channel, fetched, self.export_folder)
+        
+        state.update_channel(channel["id"], {
+            "name": cname,
+            "latest_ts": latest or since_ts,
+            "oldest_ts": oldest_ts,
+            "threads": threads,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        })
+        
+        files_created = f"{json_name}, {txt_name}"
+        if md_name:
+            files_created += f", {md_name}"
+        print(f"   ✅ Updated {files_created}")
+        return (cname, len(new_messages), json_name, txt_name, md_name)
+
+
+def parse_date(value: str, end_of_day: bool = False) -> Optional[float]:
+    """Parse a YYYY-MM-DD date into a Unix timestamp (blank means no bound)."""
+    value = value.strip()
+    if not value:
+        return None
+    day = datetime.strptime(value, "%Y-%m-%d")
+    if end_of_day:
+        day += timedelta(days=1, microseconds=-1)
+    return day.timestamp()
+
+
+def days_window(days: int) -> tuple:
+    """(oldest_ts, latest_ts) covering the last ``days`` days."""
+    return time.mktime((datetime.now() - timedelta(days=days)).timetuple()), None
 
-def main():
-    """Main execution function."""
+
+def prompt_date_range() -> tuple:
+    """Ask for a custom start/end date window, returns (oldest_ts, latest_ts)."""
+    try:
+        oldest_ts = parse_date(input("Start date (YYYY-MM-DD, blank for beginning): "))
+        latest_ts = parse_date(input("End date (YYYY-MM-DD, blank for now): "), end_of_day=True)
+    except ValueError:
+        logger.error("Invalid custom date range")
+        raise SystemExit("❌ Invalid date. Use the YYYY-MM-DD format.")
+    
+    if oldest_ts and latest_ts and oldest_ts > latest_ts:
+        logger.error("Custom date range start is after end")
+        raise SystemExit("❌ Start date must be before end date.")
+    return oldest_ts, latest_ts
+
+
+def prompt_channel_selection(channels: List[Dict]) -> List[Dict]:
+    """Ask which of the listed channels to export."""
+    sel = input("\nEnter channel number(s) (comma-separated, or 'all'): ").strip().lower()
+    if sel == "all":
+        selected = channels
+        logger.info("User selected: ALL channels")
+    else:
+        try:
+            selected = [channels[int(s)-1] for s in sel.split(",") if s.strip().isdigit()]
+            logger.info(f"User selected {len(selected)} channel(s): {[c['name'] for c in selected]}")
+        except Exception:
+            logger.error("Invalid channel selection")
+            raise SystemExit("❌ Invalid selection.")
+    
+    if not selected:
+        logger.error("No channels selected")
+        raise SystemExit("❌ No valid channels selected.")
+    return selected
+
+
+def prompt_export_window() -> tuple:
+    """Ask for the export date window, returns (oldest_ts, latest_ts)."""
+    print("\n🕓 Select export window:")
+    print("1. Last 7 days")
+    print("2. Last 30 days")
+    print("3. Last 60 days")
+    print("4. Last 90 days")
+    print("5. All messages (no filter)")
+    print("6. Custom date range")
+    choice = input("Enter selection [1-6]: ").strip()
+    
+    days_map = {"1": 7, "2": 30, "3": 60, "4": 90}
+    days = days_map.get(choice)
+    latest_ts = None
+    if days:
+        cutoff_ts, latest_ts = days_window(days)
+        print(f"⏱ Exporting messages newer than {days} days ago.\n")
+        logger.info(f"Date filter: Last {days} days")
+    elif choice == "6":
+        cutoff_ts, latest_ts = prompt_date_range()
+        start_label = datetime.fromtimestamp(cutoff_ts).strftime("%Y-%m-%d") if cutoff_ts else "beginning"
+        end_label = datetime.fromtimestamp(latest_ts).strftime("%Y-%m-%d %H:%M:%S") if latest_ts else "now"
+        print(f"⏱ Exporting messages from {start_label} to {end_label}.\n")
+        logger.info(f"Date filter: {start_label} to {end_label}")
+    else:
+        cutoff_ts = None
+        print("📜 Exporting all available messages.\n")
+        logger.info("Date filter: ALL messages")
+    return cutoff_ts, latest_ts
+
+
+def select_channels(channels: List[Dict], patterns: List[str]) -> List[Dict]:
+    """Pick channels by ID, name or a regular expression matching the whole name ('all' selects every channel)."""
+    names = [p.strip().lstrip("#") for pattern in patterns for p in pattern.split(",") if p.strip()]
+    if any(name.lower() == "all" for name in names):
+        return channels
+    try:
+        matchers = [re.compile(name) for name in names]
+    except re.error as e:
+        raise SystemExit(f"❌ Invalid channel pattern: {e}")
+    
+    selected = [
+        c for c in channels
+        if c["id"] in names or c["name"] in names or any(m.fullmatch(c["name"]) for m in matchers)
+    ]
+    if not selected:
+        logger.error(f"No channels match {names}")
+        raise SystemExit(f"❌ No channels match: {', '.join(names)}")
+    return selected
+
+
+def window_from_args(args: argparse.Namespace, default_days: Optional[int] = None) -> Optional[tuple]:
+    """The export window given with --days or --from/--to as (oldest_ts, latest_ts).
+    
+    Without either, ``default_days`` (the config's date_range_days) is used if set, else None.
+    """
+    days = args.days or (None if args.date_from or args.date_to else default_days)
+    if days:
+        print(f"⏱ Exporting messages newer than {days} days ago.\n")
+        logger.info(f"Date filter: Last {days} days")
+        return days_window(days)
+    if not (args.date_from or args.date_to):
+        return None
+    try:
+        oldest_ts = parse_date(args.date_from or "")
+        latest_ts = parse_date(args.date_to or "", end_of_day=True)
+    except ValueError:
+        raise SystemExit("❌ Invalid date. Use the YYYY-MM-DD format.")
+    if oldest_ts and latest_ts and oldest_ts > latest_ts:
+        raise SystemExit("❌ Start date must be before end date.")
+    logger.info(f"Date filter: {args.date_from or 'beginning'} to {args.date_to or 'now'}")
+    return oldest_ts, latest_ts
+
+
+def parse_shard(value: str) -> tuple:
+    """argparse type for --shard: "i/N" -> (i, N) with 1 <= i <= N."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/N with 1 <= i <= N, got {value!r}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Export Slack channels to anonymized JSON, TXT and Markdown files.",
+        epilog="Run without --channels to pick channels and the date window interactively.",
+    )
+    parser.add_argument("--config", metavar="PATH",
+                        help="config file to use (default: config.json next to this script)")
+    parser.add_argument("--channels", nargs="+", metavar="CHANNEL",
+                        help="channels to export, render or search: names, IDs, regular expressions or 'all'")
+    parser.add_argument("--from", dest="date_from", metavar="YYYY-MM-DD", help="oldest day to include")
+    parser.add_argument("--to", dest="date_to", metavar="YYYY-MM-DD", help="newest day to include")
+    parser.add_argument("--days", type=int, metavar="N", help="only include the last N days")
+    parser.add_argument("--output-dir", metavar="DIR", help="override output_dir from the config")
+    parser.add_argument("--incremental", action="store_true", help="update the rolling archive")
+    parser.add_argument("--resume", metavar="EXPORT_FOLDER", help="continue an interrupted export")
+    
+    features = parser.add_argument_group("features")
+    features.add_argument("--markdown", dest="markdown", action="store_true", help="also write Markdown files")
+    features.add_argument("--no-markdown", dest="markdown", action="store_false")
+    features.add_argument("--download-files", dest="download_files", action="store_true",
+                          help="download file attachments")
+    features.add_argument("--no-download-files", dest="download_files", action="store_false")
+    features.add_argument("--streaming", dest="streaming", action="store_true",
+                          help="spool messages to disk instead of holding them in memory")
+    features.add_argument("--compression", choices=list(COMPRESSION_SUFFIXES),
+                          help="compress the JSON/NDJSON, TXT and Markdown outputs")
+    features.add_argument("--columnar", choices=["parquet", "arrow"],
+                          help="also write each channel as a Parquet or Arrow table (needs pyarrow)")
+    parser.set_defaults(markdown=None, download_files=None, streaming=None)
+    
+    performance = parser.add_argument_group("performance")
+    performance.add_argument("--workers", type=int, metavar="N", help="channels exported in parallel")
+    performance.add_argument("--thread-workers", type=int, metavar="N",
+                             help="thread reply fetches in parallel, shared by all channels")
+    performance.add_argument("--download-workers", type=int, metavar="N", help="concurrent file downloads")
+    performance.add_argument("--refresh-cache", action="store_true", help="ignore cached API responses")
+    performance.add_argument("--no-cache", action="store_true", help="disable the API response cache")
+    
+    sharding = parser.add_argument_group("sharding")
+    sharding.add_argument("--shard", type=parse_shard, metavar="I/N",
+                          help="only export shard I of N (channels split by a hash of their ID)")
+    sharding.add_argument("--shard-folder", metavar="DIR",
+                          help="export the --shard into DIR instead of <timestamp>-shard-I-of-N")
+    sharding.add_argument("--shards", type=int, metavar="N",
+                          help="export N shards in parallel processes on this machine, then merge them")
+    sharding.add_argument("--merge-shards", nargs="+", metavar="SHARD_FOLDER",
+                          help="merge finished --shard export folders into one export folder")
+    
+    archive = parser.add_argument_group("archive and search")
+    archive.add_argument("--render", action="store_true",
+                         help="render --channels from the archive database without calling Slack")
+    archive.add_argument("--search", metavar="QUERY", help="search past exports (FTS5 query syntax)")
+    archive.add_argument("--user", metavar="ANON_ID", help="only show search hits by this anonymous user")
+    archive.add_argument("--limit", type=int, default=20, metavar="N", help="maximum search hits (default: 20)")
+    return parser
+
+
+def apply_arguments(config: Dict, args: argparse.Namespace) -> Dict:
+    """Overlay command-line options onto a loaded config dict."""
+    if args.output_dir:
+        config["output_dir"] = args.output_dir
+    features = config.setdefault("features", {})
+    for key, value in (("create_markdown", args.markdown), ("download_files", args.download_files),
+                       ("streaming_output", args.streaming)):
+        if value is not None:
+            features[key] = value
+    output = config.setdefault("output", {})
+    for key, value in (("compression", args.compression), ("columnar", args.columnar)):
+        if value is not None:
+            output[key] = value
+    performance = config.setdefault("performance", {})
+    for key, value in (("max_workers", args.workers), ("thread_workers", args.thread_workers),
+                       ("download_workers", args.download_workers)):
+        if value is not None:
+            performance[key] = value
+    if args.incremental:
+        config.setdefault("incremental", {})["enabled"] = True
+    if args.no_cache:
+        config.setdefault("cache", {})["enabled"] = False
+    return config
+
+
+def print_token_help():
+    print("\n" + "="*60)
+    print("❌ ERROR: Invalid or missing Slack token!")
+    print("="*60)
+    print("\nPlease set up your configuration:")
+    print("1. Copy config.example.json to config.json")
+    print("2. Edit config.json and add your real token")
+    print("3. Get your token from: https://api.slack.com/apps")
+    print("\nOr set the SLACK_TOKEN environment variable.")
+    print("="*60 + "\n")
+
+
+def isolate_shard_databases(settings: ExportSettings, export_folder: str, shard: tuple):
+    """Give a shard its own SQLite files, so shard processes running side by side never share one.
+    
+    The archive database and search index go into the shard folder, where
+    --merge-shards imports them. The API cache gets a file per shard next to
+    the shared one; channels always hash to the same shard, so it stays warm.
+    """
+    root, ext = os.path.splitext(settings.cache_path)
+    settings.cache_path = f"{root}-shard-{shard[0]}-of-{shard[1]}{ext}"
+    settings.archive_db_path = os.path.join(export_folder, SHARD_ARCHIVE_DB)
+    settings.search_index_path = os.path.join(export_folder, SHARD_SEARCH_INDEX)
+
+
+def write_shard_manifest(exporter: SlackExporter, shard: tuple, timestamp_str: str,
+                         summary: List[tuple], skipped: List[str], elapsed: timedelta) -> str:
+    """Record a finished shard for --merge-shards, returns the manifest path."""
+    manifest = {
+        "shard": shard[0],
+        "shards": shard[1],
+        "timestamp_str": timestamp_str,
+        "channels": [{"name": cname, "messages": count} for cname, count, *_ in summary],
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed.total_seconds(), 1),
+        "anon_map": exporter.anon_map,
+    }
+    path = os.path.join(exporter.export_folder, SHARD_MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def run_export(settings: ExportSettings, export_folder: str, timestamp_str: str,
+               channel_patterns: Optional[List[str]] = None, window: Optional[tuple] = None,
+               resume: bool = False, log_file: Optional[str] = None, shard: Optional[tuple] = None) -> int:
+    """Export channels into export_folder, returns the exit code (1 if any channel failed).
+    
+    Channels and the date window are asked for interactively unless
+    channel_patterns and window are given; resume continues the checkpoint
+    already in export_folder instead. With shard=(i, n) only the channels of
+    shard i are considered, and a shard manifest for --merge-shards is
+    written once all of them are exported.
+    """
     start_time = datetime.now()
     logger.info("=" * 60)
     logger.info("Slack Channel Export Tool - Starting")
-    logger.info(f"Export folder: {EXPORT_FOLDER}")
+    logger.info(f"Export folder: {export_folder}")
     logger.info("=" * 60)
     
+    exporter = None
     try:
-        exporter = SlackExporter(SLACK_TOKEN, EXPORT_FOLDER)
-        exporter.load_users()
-        
-        # Get and display channels (alphabetically sorted)
-        channels = exporter.get_channels()
-        logger.info(f"Found {len(channels)} accessible channels")
-        print("\n📋 Channels available (alphabetical):")
-        for i, c in enumerate(channels, start=1):
-            privacy = "🔒" if c.get("is_private") else "🌐"
-            print(f"{i:3}. {privacy} {c['name']}")
-        
-        # Channel selection
-        sel = input("\nEnter channel number(s) (comma-separated, or 'all'): ").strip().lower()
-        if sel == "all":
-            selected = channels
-            logger.info("User selected: ALL channels")
-        else:
-            try:
-                selected = [channels[int(s)-1] for s in sel.split(",") if s.strip().isdigit()]
-                logger.info(f"User selected {len(selected)} channel(s): {[c['name'] for c in selected]}")
-            except Exception:
-                logger.error("Invalid channel selection")
-                raise SystemExit("❌ Invalid selection.")
-        
-        if not selected:
-            logger.error("No channels selected")
-            raise SystemExit("❌ No valid channels selected.")
-        
-        # Date range filter
-        print("\n🕓 Select export window:")
-        print("1. Last 7 days")
-        print("2. Last 30 days")
-        print("3. Last 60 days")
-        print("4. Last 90 days")
-        print("5. All messages (no filter)")
-        choice = input("Enter selection [1-5]: ").strip()
-        
-        days_map = {"1": 7, "2": 30, "3": 60, "4": 90}
-        days = days_map.get(choice)
-        if days:
-            cutoff_ts = time.mktime((datetime.now() - timedelta(days=days)).timetuple())
-            print(f"⏱ Exporting messages newer than {days} days ago.\n")
-            logger.info(f"Date filter: Last {days} days")
+        checkpoint = Checkpoint(export_folder)
+        if resume:
+            # The interrupted run decides the mode and spool layout, not this command line
+            saved = checkpoint.settings
+            settings.incremental = saved.get("incremental", settings.incremental)
+            settings.streaming_output = saved.get("streaming_output", settings.streaming_output)
+            if saved.get("shard"):
+                shard = tuple(saved["shard"])
+        if shard:
+            isolate_shard_databases(settings, export_folder, shard)
+        exporter = SlackExporter(settings.slack_token, export_folder, settings=settings)
+        state = None
+        if settings.incremental:
+            state = ExportState(os.path.join(export_folder, STATE_FILENAME))
+            exporter.restore_anon_map(state.anon_map())
+            logger.info(f"Incremental mode: archive {export_folder}")
+        
+        if resume:
+            if not checkpoint.exists():
+                logger.error(f"No checkpoint found in {export_folder}")
+                raise SystemExit(f"❌ No checkpoint found in {export_folder} - nothing to resume.")
+            saved = checkpoint.settings
+            selected = saved["channels"]
+            cutoff_ts = saved.get("cutoff_ts")
+            latest_ts = saved.get("latest_ts")
+            timestamp_str = saved["timestamp_str"]
+            shard = tuple(saved["shard"]) if saved.get("shard") else None
+            exporter.restore_anon_map(checkpoint.anon_map())
+            results = checkpoint.completed()
+            print(f"\n↻ Resuming export in {export_folder}")
+            print(f"   {len(results)} of {len(selected)} channels already exported\n")
+            logger.info(f"Resuming export: {len(results)}/{len(selected)} channels done")
+            exporter.load_users()
         else:
-            cutoff_ts = None
-            print("📜 Exporting all available messages.\n")
-            logger.info("Date filter: ALL messages")
+            exporter.load_users()
+            
+            # Get and display channels (alphabetically sorted)
+            channels = exporter.get_channels()
+            logger.info(f"Found {len(channels)} accessible channels")
+            if shard:
+                index, count = shard
+                total = len(channels)
+                channels = [c for c in channels if shard_of(c["id"], count) == index]
+                print(f"\n🧩 Shard {index}/{count}: {len(channels)} of {total} channels")
+                logger.info(f"Shard {index}/{count}: {len(channels)} of {total} channels")
+            if channel_patterns:
+                selected = select_channels(channels, channel_patterns)
+                print(f"\n📋 Exporting {len(selected)} of {len(channels)} channels: "
+                      f"{', '.join(c['name'] for c in selected)}\n")
+                logger.info(f"Selected {len(selected)} channel(s): {[c['name'] for c in selected]}")
+            else:
+                print("\n📋 Channels available (alphabetical):")
+                for i, c in enumerate(channels, start=1):
+                    privacy = "🔒" if c.get("is_private") else "🌐"
+                    print(f"{i:3}. {privacy} {c['name']}")
+                selected = prompt_channel_selection(channels)
+            cutoff_ts, latest_ts = window if window is not None else prompt_export_window()
+            
+            # Start a fresh checkpoint (a stale one from an earlier failed run is discarded)
+            checkpoint.clear()
+            checkpoint.start({
+                "channels": [{k: c.get(k) for k in ("id", "name", "is_private")} for c in selected],
+                "cutoff_ts": cutoff_ts,
+                "latest_ts": latest_ts,
+                "timestamp_str": timestamp_str,
+                "incremental": settings.incremental,
+                "streaming_output": settings.streaming_output,
+                "shard": list(shard) if shard else None,
+            })
+            results = {}
+        exporter.checkpoint = checkpoint
         
-        print(f"Files will be created in:\n📂 {EXPORT_FOLDER}\n")
+        if settings.incremental:
+            print("🔁 Incremental mode: only new messages and thread replies are fetched.")
+            print("   The export window above only applies to channels not yet in the archive.\n")
+            print(f"Archive will be updated in:\n📂 {export_folder}\n")
+        else:
+            print(f"Files will be created in:\n📂 {export_folder}\n")
         
-        if DOWNLOAD_FILES:
+        if settings.download_files:
             print("📥 File downloads enabled - this may take longer\n")
             logger.info("File downloads: ENABLED")
         
-        # Create timestamp for filenames (YYYY-MM-DD-HHMM format)
-        timestamp_str = datetime.now().strftime("%Y-%m-%d-%H%M")
-        
         # Export channels
         summary = []
         skipped = []
+        remaining = [ch for ch in selected if ch["id"] not in results]
         
-        for ch in selected:
-            try:
-                result = exporter.export_channel(ch, cutoff_ts, timestamp_str)
-                if result[1] == 0:  # No messages
-                    skipped.append(result[0])
+        def export_one(ch):
+            with exporter.metrics.stage(ch["name"], "total"):
+                if state is not None:
+                    result = exporter.export_channel_incremental(ch, cutoff_ts, latest_ts, state)
                 else:
-                    summary.append(result)
-            except Exception as e:
-                error_msg = f"Error exporting #{ch['name']}: {e}"
-                print(f"❌ {error_msg}")
-                logger.error(error_msg, exc_info=True)
+                    result = exporter.export_channel(ch, cutoff_ts, timestamp_str, latest_ts)
+            checkpoint.complete_channel(ch["id"], result, exporter.anon_map)
+            return result
+        
+        if settings.max_workers > 1 and len(remaining) > 1:
+            workers = min(settings.max_workers, len(remaining))
+            print(f"⚡ Exporting {len(remaining)} channels with {workers} parallel workers\n")
+            logger.info(f"Parallel export: {workers} workers")
+            pool = ThreadPoolExecutor(max_workers=workers)
+            futures = {
+                pool.submit(export_one, ch): ch
+                for ch in remaining
+            }
+            try:
+                for future in as_completed(futures):
+                    ch = futures[future]
+                    try:
+                        results[ch["id"]] = future.result()
+                    except Exception as e:
+                        error_msg = f"Error exporting #{ch['name']}: {e}"
+                        print(f"❌ {error_msg}")
+                        logger.error(error_msg, exc_info=True)
+            finally:
+                for future in futures:
+                    future.cancel()
+                pool.shutdown(wait=True)
+        else:
+            for ch in remaining:
+                try:
+                    results[ch["id"]] = export_one(ch)
+                except Exception as e:
+                    error_msg = f"Error exporting #{ch['name']}: {e}"
+                    print(f"❌ {error_msg}")
+                    logger.error(error_msg, exc_info=True)
+                    continue
+        
+        # Keep the summary in selection order regardless of completion order
+        for ch in selected:
+            result = results.get(ch["id"])
+            if result is None:
                 continue
+            if result[1] == 0:  # No messages
+                skipped.append(result[0])
+            else:
+                summary.append(result)
+        
+        failed = [ch["name"] for ch in selected if ch["id"] not in results]
+        if failed:
+            print(f"\n⚠️  {len(failed)} channel(s) failed: {', '.join(failed)}")
+            print(f"   Retry them with: python {os.path.basename(__file__)} --resume \"{export_folder}\"")
+            logger.warning(f"Failed channels (checkpoint kept for --resume): {failed}")
+        else:
+            checkpoint.clear()
         
         # Summary table
         if summary or skipped:
@@ -690,25 +3347,39 @@ def main():
                     files += f", {mfile}"
                 print(f"{cname:<25} {count:<10} {files:<60}")
             
-            if skipped:
+            if skipped and settings.incremental:
+                print("\n⚠️  Channels with nothing new since the last run (archive unchanged):")
+                for cname in skipped:
+                    print(f"   • {cname}")
+                logger.info(f"Unchanged channels: {skipped}")
+            elif skipped:
                 print("\n⚠️  Channels with no messages in date range (files not created):")
                 for cname in skipped:
                     print(f"   • {cname}")
                 logger.info(f"Skipped {len(skipped)} empty channels: {skipped}")
             
             print("─" * 100)
-            print(f"🎯 Files saved to: {EXPORT_FOLDER}\n")
+            print(f"🎯 Files saved to: {export_folder}\n")
             
-            if DOWNLOAD_FILES:
-                attach_dir = os.path.join(EXPORT_FOLDER, "attachments")
+            if settings.download_files:
+                attach_dir = os.path.join(export_folder, "attachments")
                 if os.path.exists(attach_dir):
-                    print(f"📥 Attachments saved to: {attach_dir}\n")
+                    print(f"📥 Attachments saved to: {attach_dir}")
+                    print(f"   {exporter.downloads.progress_line()}")
+                    if exporter.blob_store and exporter.blob_store.hits:
+                        print(f"   ♻️  {exporter.blob_store.hits} file(s) reused from the blob store without downloading")
+                    if exporter.url_refresher.calls:
+                        print(f"   🔄 {exporter.url_refresher.calls} download URL(s) refreshed via files.info")
+                    if exporter.downloads.failed:
+                        print(f"   ⚠️  {exporter.downloads.failed} file(s) could not be downloaded (see log)")
+                    print()
+                    logger.info(f"Attachments: {exporter.downloads.progress_line()}, {exporter.downloads.failed} failed")
+            
+            if state is not None:
+                state.update_anon_map(exporter.anon_map)
             
             # Save anonymization key
-            key_file = os.path.join(EXPORT_FOLDER, f"{timestamp_str}-anonymization-key.json")
-            anon_key = {anon: exporter.id_to_name.get(uid, uid) for uid, anon in exporter.anon_map.items()}
-            with open(key_file, "w", encoding="utf-8") as kf:
-                json.dump(anon_key, kf, indent=2)
+            key_file = exporter.save_anonymization_key(None if settings.incremental else timestamp_str)
             print(f"🔑 Anonymization key saved to: {os.path.basename(key_file)}")
             print("    (Keep this file secure - it maps anonymous IDs back to real usernames)\n")
             logger.info(f"Saved anonymization key: {key_file}")
@@ -721,28 +3392,443 @@ def main():
             print(f"   • Total messages: {total_messages}")
             print(f"   • Time elapsed: {elapsed_time.total_seconds():.1f} seconds")
             
-            if ENABLE_LOGGING:
-                print(f"   • Log file: {EXPORT_TIMESTAMP}-export.log")
+            if log_file:
+                print(f"   • Log file: {os.path.basename(log_file)}")
+            
+            print("\n📡 API Throughput:")
+            for method, (calls, rate) in exporter.scheduler.report().items():
+                print(f"   • {method:<24} {calls:>6} calls  {rate:6.2f} req/s")
+                logger.info(f"API {method}: {calls} calls, {rate:.2f} req/s")
+            if exporter.cache:
+                print(f"   • 🗄️  API cache: {exporter.cache.hits} hits, {exporter.cache.misses} misses")
+                logger.info(f"API cache: {exporter.cache.hits} hits, {exporter.cache.misses} misses")
+            api_stats = exporter.metrics.as_dict()["api"].values()
+            ratelimited = sum(s["ratelimited"] for s in api_stats)
+            if ratelimited:
+                waited = sum(s["scheduler_wait_seconds"] for s in api_stats)
+                print(f"   • ⏳ {ratelimited} ratelimited call(s), calls waited {waited:.1f}s in total (all workers)")
             
             logger.info("=" * 60)
             logger.info(f"Export completed successfully")
             logger.info(f"Channels: {len(summary)}, Messages: {total_messages}, Time: {elapsed_time.total_seconds():.1f}s")
             logger.info("=" * 60)
         
+        if shard and not failed:
+            manifest_file = write_shard_manifest(exporter, shard, timestamp_str, summary, skipped,
+                                                 datetime.now() - start_time)
+            print(f"🧩 Shard {shard[0]}/{shard[1]} complete, manifest saved to: {os.path.basename(manifest_file)}")
+            print(f"   Merge all shards with: python {os.path.basename(__file__)} --merge-shards <shard folders>")
+            logger.info(f"Saved shard manifest: {manifest_file}")
+        
     except KeyboardInterrupt:
         print("\n\n⚠️  Export interrupted by user")
+        print(f"   Continue later with: python {os.path.basename(__file__)} --resume \"{export_folder}\"")
         logger.warning("Export interrupted by user (KeyboardInterrupt)")
-        sys.exit(1)
+        return 1
     except Exception as e:
         error_msg = f"Fatal error: {e}"
         print(f"\n❌ {error_msg}")
+        if os.path.exists(os.path.join(export_folder, CHECKPOINT_DIRNAME)):
+            print(f"   Continue later with: python {os.path.basename(__file__)} --resume \"{export_folder}\"")
         logger.error(error_msg, exc_info=True)
-        sys.exit(1)
+        return 1
+    finally:
+        if exporter is not None:
+            try:
+                metrics_file = exporter.write_metrics()
+                if metrics_file:
+                    print(f"📈 Metrics saved to: {os.path.basename(metrics_file)}")
+                    logger.info(f"Saved metrics: {metrics_file}")
+            except OSError as e:
+                logger.warning(f"Could not write metrics: {e}")
+            exporter.close()
+    return 1 if failed else 0
+
+
+def render_archive(settings: ExportSettings, args: argparse.Namespace, export_folder: str, timestamp_str: str) -> int:
+    """Render channels from the SQLite archive into a new export folder, without calling Slack."""
+    start_time = time.monotonic()
+    archive_path = settings.archive_db_path
+    if not os.path.exists(archive_path):
+        raise SystemExit(f"❌ No archive database at {archive_path} - export with archive_db.enabled first.")
+    oldest, latest = window_from_args(args) or (None, None)
+    
+    exporter = SlackExporter(settings.slack_token, export_folder, settings=settings)
+    store = ArchiveStore(archive_path)
+    try:
+        exporter.id_to_name = store.user_names()
+        channels = store.channels()
+        if args.channels:
+            channels = select_channels(channels, args.channels)
+        if not channels:
+            raise SystemExit(f"❌ None of the requested channels are in {archive_path}")
+        
+        print(f"\n🗃️  Rendering {len(channels)} channel(s) from {archive_path}")
+        print(f"Files will be created in:\n📂 {export_folder}\n")
+        logger.info(f"Rendering {[c['name'] for c in channels]} from archive {archive_path}")
+        total = 0
+        for channel in channels:
+            messages = store.load_messages(channel["id"], oldest, latest, export_folder)
+            if not messages:
+                print(f"   ⚠️  #{channel['name']}: no archived messages in range")
+                continue
+            names = exporter.write_outputs(
+                channel["name"], messages, f"{timestamp_str}-Slack-Export-{channel['name']}", channel["id"]
+            )
+            total += len(messages)
+            print(f"   ✅ #{channel['name']}: {len(messages)} messages → {', '.join(n for n in names if n)}")
+        
+        key_file = exporter.save_anonymization_key(timestamp_str)
+        print(f"\n🔑 Anonymization key saved to: {os.path.basename(key_file)}")
+        print(f"📊 Rendered {total} messages in {time.monotonic() - start_time:.1f} seconds (no API calls)")
+        logger.info(f"Rendered {total} messages from archive")
+    finally:
+        store.close()
+        exporter.close()
+    return 0
+
+
+def search_exports(settings: ExportSettings, args: argparse.Namespace) -> int:
+    """Print search index hits for a query, with thread context."""
+    index_path = settings.search_index_path
+    if not os.path.exists(index_path):
+        raise SystemExit(f"❌ No search index at {index_path} - export with search_index.enabled first.")
+    oldest, latest = window_from_args(args) or (None, None)
+    index = SearchIndex(index_path)
+    try:
+        start = time.perf_counter()
+        try:
+            hits = index.search(args.search, args.channels, args.user, oldest, latest, args.limit)
+        except sqlite3.OperationalError as e:
+            raise SystemExit(f"❌ Invalid search query: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        print(f"\n🔎 {len(hits)} hit(s) for \"{args.search}\" ({elapsed_ms:.1f} ms)\n")
+        for hit in hits:
+            when = datetime.fromtimestamp(float(hit["ts"])).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"#{hit['channel']}  {hit['author']} [{when}]  (export {hit['export']})")
+            print(f"   {hit['snippet']}")
+            for ts, anon, text in hit["thread"]:
+                marker = "→" if ts == hit["ts"] else "·"
+                reply_time = datetime.fromtimestamp(float(ts)).strftime("%Y-%m-%d %H:%M")
+                print(f"     {marker} {anon} [{reply_time}]: {text[:120]}")
+            print()
+    finally:
+        index.close()
+    return 0
+
+
+def copy_shard_files(folder: str, manifest: Dict, export_folder: str, timestamp_str: str, rename: Dict[str, str]):
+    """Copy one shard's channel files, attachments, log and metrics into the merged folder.
+
+    Files are hardlinked where possible. TXT, Markdown, Parquet and Arrow
+    files are rewritten through `rename` (shard anon ID -> merged anon ID)
+    unless it changes nothing.
+    """
+    prefix = manifest["timestamp_str"] + "-"
+    tag = f"shard-{manifest['shard']}-of-{manifest['shards']}"
+    renumbered = any(old != new for old, new in rename.items())
+    for name in sorted(os.listdir(folder)):
+        src = os.path.join(folder, name)
+        if not os.path.isfile(src):
+            continue
+        if name.startswith(prefix + "Slack-Export-"):
+            dst = os.path.join(export_folder, f"{timestamp_str}-{name[len(prefix):]}")
+        elif name == f"{prefix}export.log":
+            dst = os.path.join(export_folder, f"{timestamp_str}-{tag}-export.log")
+        elif name == METRICS_FILENAME:
+            dst = os.path.join(export_folder, f"metrics-{tag}.json")
+        else:
+            continue
+        compression = compression_of(name)
+        plain_name = name[:len(name) - len(COMPRESSION_SUFFIXES[compression])]
+        if renumbered and plain_name.endswith((".txt", ".md")):
+            with open_output(src, "rt", compression, newline="") as fin, \
+                    open_output(dst, "wt", compression, newline="") as fout:
+                for line in fin:
+                    fout.write(ANON_ID_RE.sub(lambda m: rename.get(m.group(0), m.group(0)), line))
+        elif renumbered and name.endswith((ColumnarWriter.suffix, ArrowWriter.suffix)):
+            rename_columnar(src, dst, rename)
+        else:
+            BlobStore.place(src, dst, "hardlink")
+
+    attach_dir = os.path.join(folder, "attachments")
+    if not os.path.isdir(attach_dir):
+        return
+    merged_attach_dir = os.path.join(export_folder, "attachments")
+    os.makedirs(merged_attach_dir, exist_ok=True)
+    for name in sorted(os.listdir(attach_dir)):
+        src = os.path.join(attach_dir, name)
+        if os.path.isdir(src):
+            # Every channel belongs to exactly one shard, so channel folders never collide
+            shutil.copytree(src, os.path.join(merged_attach_dir, name),
+                            copy_function=lambda s, d: BlobStore.place(s, d, "hardlink"))
+        elif name == "manifest.ndjson":
+            with open(src, "r", encoding="utf-8") as fin, \
+                    open(os.path.join(merged_attach_dir, name), "a", encoding="utf-8") as fout:
+                shutil.copyfileobj(fin, fout)
+
+
+def rename_columnar(src: str, dst: str, rename: Dict[str, str]):
+    """Copy a Parquet or Arrow channel file, mapping anon IDs in its user and text columns."""
+    if not HAS_PYARROW:
+        raise ValueError(f"{os.path.basename(src)} needs the pyarrow package to merge: pip install pyarrow")
+    arrow = src.endswith(ArrowWriter.suffix)
+    if arrow:
+        with pyarrow.OSFile(src) as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+    else:
+        table = pyarrow.parquet.read_table(src)
+    sub = lambda text: ANON_ID_RE.sub(lambda m: rename.get(m.group(0), m.group(0)), text) if text else text
+    for column, mapper in (("user", lambda anon: rename.get(anon, anon)), ("text", sub)):
+        index = table.schema.get_field_index(column)
+        values = pyarrow.array([mapper(v) for v in table.column(column).to_pylist()], pyarrow.string())
+        table = table.set_column(index, column, values)
+    if arrow:
+        with pyarrow.ipc.new_file(dst, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pyarrow.parquet.write_table(table, dst, compression="zstd")
+
+
+def merge_shards(shard_folders: List[str], export_folder: str, timestamp_str: str,
+                 settings: ExportSettings) -> int:
+    """Merge the folders of a finished --shard i/N export into export_folder.
+    
+    Each shard numbers sequential anonymous IDs on its own, so the merge
+    assigns one workspace-wide numbering (in shard order), rewrites the
+    TXT/Markdown files to it and writes a single anonymization key and
+    summary. Keyed pseudonyms agree across shards and are kept as they are.
+    The shards' archive databases and search indexes are imported into the
+    configured ones, with search entries renumbered and linked to export_folder.
+    """
+    parts = []
+    for folder in shard_folders:
+        folder = os.path.abspath(folder)
+        manifest_path = os.path.join(folder, SHARD_MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise SystemExit(f"❌ {folder} has no {SHARD_MANIFEST} - finish that shard first "
+                             f"(--resume it if it failed).")
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            parts.append((folder, json.load(f)))
+    parts.sort(key=lambda part: part[1]["shard"])
+    count = parts[0][1]["shards"]
+    found = [f"{m['shard']}/{m['shards']}" for _, m in parts]
+    if found != [f"{i}/{count}" for i in range(1, count + 1)]:
+        raise SystemExit(f"❌ Expected shards 1/{count} to {count}/{count} once each, got: {', '.join(found)}")
+
+    print(f"\n🧩 Merging {count} shard(s) into:\n📂 {export_folder}\n")
+    logger.info(f"Merging shards {[folder for folder, _ in parts]} into {export_folder}")
+    anon_map = {}  # user ID -> merged anon ID
+    anon_key = {}
+    sequential = 0
+    summary = []
+    skipped = []
+    archive = search_index = None
+    for folder, manifest in parts:
+        key_path = os.path.join(folder, f"{manifest['timestamp_str']}-anonymization-key.json")
+        shard_key = {}
+        if os.path.exists(key_path):
+            with open(key_path, "r", encoding="utf-8") as f:
+                shard_key = json.load(f)
+        rename = {}
+        for uid, anon in sorted(manifest["anon_map"].items(),
+                                key=lambda item: int(item[1][4:]) if item[1][4:].isdigit() else 0):
+            if not ANON_ID_RE.fullmatch(anon):
+                # Keyed pseudonyms are the same on every shard and are kept as they are
+                if anon_map.setdefault(uid, anon) != anon:
+                    raise SystemExit("❌ The shards were anonymized with different pseudonym settings or secrets.")
+                anon_key[anon] = shard_key.get(anon, uid)
+                continue
+            if uid not in anon_map:
+                sequential += 1
+                anon_map[uid] = f"anon{sequential:02d}"
+                anon_key[anon_map[uid]] = shard_key.get(anon, uid)
+            rename[anon] = anon_map[uid]
+        copy_shard_files(folder, manifest, export_folder, timestamp_str, rename)
+        shard_archive = os.path.join(folder, SHARD_ARCHIVE_DB)
+        if os.path.exists(shard_archive):
+            archive = archive or ArchiveStore(settings.archive_db_path)
+            archive.import_shard(shard_archive, folder, export_folder)
+        shard_index = os.path.join(folder, SHARD_SEARCH_INDEX)
+        if os.path.exists(shard_index):
+            search_index = search_index or SearchIndex(settings.search_index_path)
+            search_index.import_shard(shard_index, os.path.basename(export_folder), rename)
+        summary.extend((c["name"], c["messages"], manifest["shard"]) for c in manifest["channels"])
+        skipped.extend(manifest["skipped"])
+        logger.info(f"Merged shard {manifest['shard']}/{count} from {folder}")
+
+    for store in (archive, search_index):
+        if store is not None:
+            store.close()
+    key_file = os.path.join(export_folder, f"{timestamp_str}-anonymization-key.json")
+    with open(key_file, "w", encoding="utf-8") as kf:
+        json.dump(anon_key, kf, indent=2)
+    with open(os.path.join(export_folder, SHARD_SUMMARY), "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp_str": timestamp_str,
+            "shards": [{k: v for k, v in manifest.items() if k != "anon_map"} for _, manifest in parts],
+        }, f, indent=2)
+
+    print("🧾 MERGED SUMMARY")
+    print("─" * 60)
+    print(f"{'Channel':<25} {'Messages':<10} {'Shard':<10}")
+    print("─" * 60)
+    for cname, messages, index in sorted(summary):
+        print(f"{cname:<25} {messages:<10} {index}/{count}")
+    if skipped:
+        print(f"\n⚠️  Channels with no messages in date range: {', '.join(sorted(skipped))}")
+    print("─" * 60)
+    print(f"🔑 Anonymization key saved to: {os.path.basename(key_file)}")
+    print("    (Keep this file secure - it maps anonymous IDs back to real usernames)\n")
+    slowest = max(manifest["elapsed_seconds"] for _, manifest in parts)
+    print(f"📊 Merged {len(summary)} channels, {sum(s[1] for s in summary)} messages "
+          f"and {len(anon_key)} users from {count} shard(s) (slowest shard: {slowest:.1f} seconds)")
+    logger.info(f"Merged {count} shards: {len(summary)} channels, {len(anon_key)} users")
+    return 0
+
+
+def shard_arguments(args: argparse.Namespace) -> List[str]:
+    """The export options of a --shards run, as command-line arguments for its children."""
+    child_argv = ["--channels", *(args.channels or ["all"])]
+    for flag, value in (("--config", args.config), ("--from", args.date_from), ("--to", args.date_to),
+                        ("--days", args.days), ("--output-dir", args.output_dir),
+                        ("--compression", args.compression), ("--columnar", args.columnar),
+                        ("--workers", args.workers), ("--thread-workers", args.thread_workers),
+                        ("--download-workers", args.download_workers)):
+        if value is not None:
+            child_argv += [flag, str(value)]
+    for flag, value in (("--markdown", args.markdown), ("--download-files", args.download_files)):
+        if value is not None:
+            child_argv.append(flag if value else "--no-" + flag[2:])
+    for flag, value in (("--streaming", args.streaming), ("--refresh-cache", args.refresh_cache),
+                        ("--no-cache", args.no_cache)):
+        if value:
+            child_argv.append(flag)
+    return child_argv
+
+
+def run_shards(args: argparse.Namespace, settings: ExportSettings, export_folder: str, timestamp_str: str) -> int:
+    """Export args.shards shards as child processes of this script, then merge them.
+    
+    Each child runs with the same export options and --shard i/N, so it picks
+    up its own token from sharding.tokens, and is told the folder to export
+    into, so exactly those folders are merged.
+    """
+    count = args.shards
+    child_argv = shard_arguments(args)
+    folders = [os.path.join(settings.output_dir, f"{timestamp_str}-shard-{index}-of-{count}")
+               for index in range(1, count + 1)]
+    for folder in folders:
+        if os.path.exists(folder):
+            raise SystemExit(f"❌ {folder} already exists - wait a minute or move it before starting new shards.")
+
+    print(f"\n🧩 Exporting {count} shards in parallel processes")
+    logger.info(f"Starting {count} shard processes")
+    children = []
+    for index in range(1, count + 1):
+        out_path = os.path.join(export_folder, f"shard-{index}-of-{count}.out")
+        out = open(out_path, "w", encoding="utf-8")
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), *child_argv,
+             "--shard", f"{index}/{count}", "--shard-folder", folders[index - 1]],
+            stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT,
+            env=dict(os.environ, PYTHONIOENCODING="utf-8"),
+        )
+        children.append((index, proc, out, out_path))
+
+    failed = []
+    for index, proc, out, out_path in children:
+        code = proc.wait()
+        out.close()
+        status = "✅" if code == 0 else "❌"
+        print(f"   {status} Shard {index}/{count} exited with code {code} (output: {os.path.basename(out_path)})")
+        if code:
+            failed.append(index)
+    if failed:
+        print(f"\n⚠️  Shard(s) {', '.join(map(str, failed))} failed. Resume each with "
+              f"--resume <shard folder>, then merge with --merge-shards.")
+        logger.warning(f"Shards failed: {failed}")
+        return 1
+    return merge_shards(folders, export_folder, timestamp_str, settings)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command-line entry point, returns the process exit code."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if (args.shard or args.shards) and (args.incremental or args.render or args.search):
+        parser.error("--shard/--shards only work for regular exports")
+    if args.shards and (args.shard or args.resume):
+        parser.error("--shards can't be combined with --shard or --resume, resume each shard folder on its own")
+    if args.shard_folder and not args.shard:
+        parser.error("--shard-folder needs --shard")
+    settings = ExportSettings(apply_arguments(load_config(args.config), args))
+    settings.cache_refresh = args.refresh_cache
+    
+    if args.search:
+        logging.basicConfig(level=logging.WARNING)
+        return search_exports(settings, args)
+    
+    # Timestamp for the export folder and filenames (YYYY-MM-DD-HHMM format)
+    timestamp_str = datetime.now().strftime("%Y-%m-%d-%H%M")
+    if args.render:
+        export_folder = os.path.join(settings.output_dir, timestamp_str)
+        os.makedirs(export_folder, exist_ok=True)
+        setup_logging(settings, export_folder, timestamp_str)
+        return render_archive(settings, args, export_folder, timestamp_str)
+    if args.merge_shards:
+        export_folder = os.path.join(settings.output_dir, timestamp_str)
+        os.makedirs(export_folder, exist_ok=True)
+        setup_logging(settings, export_folder, timestamp_str)
+        return merge_shards(args.merge_shards, export_folder, timestamp_str, settings)
+    if args.shards:
+        if not (settings.shard_tokens or settings.token_is_valid()):
+            print_token_help()
+            return 1
+        export_folder = os.path.join(settings.output_dir, timestamp_str)
+        os.makedirs(export_folder, exist_ok=True)
+        setup_logging(settings, export_folder, timestamp_str)
+        if settings.pseudonyms == "keyed":
+            load_pseudonym_key(settings)  # Create the secret once, before the shards race for it
+        return run_shards(args, settings, export_folder, timestamp_str)
+    
+    if args.shard and settings.shard_tokens:
+        # Spread the shards over several tokens (and so several rate-limit budgets)
+        settings.slack_token = settings.shard_tokens[(args.shard[0] - 1) % len(settings.shard_tokens)]
+    
+    # Incremental runs update one rolling archive instead of a timestamped folder
+    if args.resume:
+        export_folder = os.path.abspath(args.resume)
+    elif settings.incremental:
+        export_folder = settings.archive_dir
+    elif args.shard:
+        export_folder = os.path.abspath(args.shard_folder or os.path.join(
+            settings.output_dir, f"{timestamp_str}-shard-{args.shard[0]}-of-{args.shard[1]}"))
+    else:
+        export_folder = os.path.join(settings.output_dir, timestamp_str)
+    
+    interactive = not (args.channels or args.resume)
+    try:
+        if not settings.token_is_valid():
+            print_token_help()
+            return 1
+        os.makedirs(export_folder, exist_ok=True)
+        log_file = setup_logging(settings, export_folder, timestamp_str)
+        window = window_from_args(args, settings.date_range_days)
+        if window is None and not interactive:
+            window = (None, None)
+        return run_export(settings, export_folder, timestamp_str, args.channels, window,
+                          resume=bool(args.resume), log_file=log_file, shard=args.shard)
     finally:
-        # Pause before closing (Windows convenience)
-        print("\n" + "─" * 60)
-        input("Press Enter to exit...")
+        if interactive:
+            # Pause before closing (Windows convenience)
+            print("\n" + "─" * 60)
+            input("Press Enter to exit...")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())